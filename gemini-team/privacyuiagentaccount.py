@@ -24,11 +24,34 @@ import sys
 import time
 import os, re, random
 import io
-from typing import Any, Dict, List, Tuple
+import subprocess
+import tempfile
+import hashlib
+import itertools
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
 from datetime import datetime
 import pyautogui
-from PIL import Image
-from playwright.sync_api import sync_playwright, Playwright, Browser, Page
+
+if TYPE_CHECKING:
+    # playwright.sync_api is slow to import; the runtime import lives in run_agent().
+    from playwright.sync_api import Page
+
+try:
+    import xxhash  # optional: faster frame hashing
+except ImportError:
+    xxhash = None
+
+try:
+    import pyperclip  # optional: paste text in one keystroke instead of typing it per char (opt-in, see PASTE_TEXT)
+except ImportError:
+    pyperclip = None
+
+try:
+    import mss  # optional: ctypes screen grab, much cheaper than pyautogui/pyscreeze
+except ImportError:
+    mss = None
 
 from google import genai
 from google.genai import types
@@ -46,21 +69,110 @@ PLANNING_MODEL_ID = 'gemini-2.5-pro'
 DEVICE_TYPE = "MacBook"
 # DEVICE_TYPE = "Windows 11 PC"
 
+IS_DARWIN = sys.platform == "darwin"
+SELECT_ALL_KEYS = ('command', 'a') if IS_DARWIN else ('ctrl', 'a')  # pyautogui
+SELECT_ALL_CHORD = "Meta+A" if IS_DARWIN else "Control+A"            # Playwright keyboard
+PASTE_KEYS = ('command', 'v') if IS_DARWIN else ('ctrl', 'v')          # pyautogui
+PASTE_MIN_LEN = 3  # shorter strings are typed; a paste can flash or misfire for 1-2 chars
+# Clipboard paste for OS-level typing is opt-in: clipboard history tools and Universal Clipboard
+# can capture whatever passes through it. Secrets (signup email/password) are always typed.
+PASTE_TEXT = os.environ.get("AGENT_PASTE_TEXT", "") == "1"
+PASTE_CONFIRM_S = 1.0  # how long to wait for the pasted value to show up before restoring the clipboard
+
 pyautogui.FAILSAFE = True 
-pyautogui.PAUSE = 1.0
+# Explicit load-state waits (Playwright) and the per-turn settle cover UI latency;
+# a long global PAUSE just adds dead time after every pyautogui primitive.
+pyautogui.PAUSE = 0.05
+pyautogui.MINIMUM_DURATION = 0
+pyautogui.MINIMUM_SLEEP = 0
+
+# Per-request HTTP timeout for Gemini calls. A stalled request that loses the hedge race in
+# _generate_hedged would otherwise hold its _executor worker forever.
+MODEL_HTTP_TIMEOUT_S = 120
+
+def _make_client() -> genai.Client:
+    """One long-lived client with a keep-alive pool, so idle gaps between turns (action
+    execution, settle waits) don't tear down the TLS session. HTTP/2 when `h2` is installed."""
+    try:
+        import httpx
+        try:
+            import h2  # noqa: F401  (httpx's HTTP/2 support)
+            http2 = True
+        except ImportError:
+            http2 = False
+        transport = httpx.HTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=180),
+        )
+        return genai.Client(api_key=API_KEY, http_options=types.HttpOptions(
+            timeout=MODEL_HTTP_TIMEOUT_S * 1000,  # milliseconds
+            client_args={"transport": transport},
+        ))
+    except Exception:
+        # Older google-genai releases don't accept client_args; the default client still pools.
+        return genai.Client(api_key=API_KEY, http_options=types.HttpOptions(timeout=MODEL_HTTP_TIMEOUT_S * 1000))
+
+def _warm_connection() -> None:
+    try:
+        client.models.get(model=MODEL_ID)
+    except Exception:
+        pass
+
+client = _make_client()
+
+# Background workers for network-bound model calls. Playwright's sync API is bound to the
+# main thread, so browser/UI work stays there and only API requests are moved off it.
+# Sized for the turn's model call plus a hedged duplicate (and a slow loser still draining).
+_executor = ThreadPoolExecutor(max_workers=4)
 
-client = genai.Client(api_key=API_KEY)
+# If a model call hasn't answered after this long, race a second identical request against it.
+MODEL_HEDGE_AFTER_S = float(os.environ.get("MODEL_HEDGE_AFTER_S", "20"))
 
 SCREEN_WIDTH, SCREEN_HEIGHT = pyautogui.size()
 cuse_grid = 1000
+# Model grid -> screen px multipliers, applied inline by the tool handlers
+_XSCALE = SCREEN_WIDTH / cuse_grid
+_YSCALE = SCREEN_HEIGHT / cuse_grid
+
+# Screenshots sent to the model are JPEG: 5-10x smaller than PNG and still legible for UI.
+# macOS gets JPEG straight from `screencapture`; elsewhere PIL encodes it.
+SCREENSHOT_MIME_TYPE = "image/jpeg"
+SCREENSHOT_JPEG_QUALITY = 70
+SCREENSHOT_MAX_DIM = 1024  # long edge, px; Gemini resizes larger images to ~768-1024 anyway
+
+# Tools that return data without touching the UI; their acks don't need a fresh screenshot.
+# (Tab switches/opens do change what's visible, so they're deliberately not listed.)
+_NON_VISUAL_TOOLS = frozenset({"provide_signup_email", "provide_signup_password", "save_consent_screenshot"})
+
+# Tools after which the next screenshot waits NAV_SETTLE_SEC for the page to paint
+_SETTLE_AFTER_TOOLS = frozenset({"open_browser_and_navigate", "pw_navigate", "navigate", "pw_go_back", "tabs_open_new"})
+NAV_SETTLE_SEC = 0.5
+
+# Gemini key names -> pyautogui key names
+_KEY_MAP = {"control": "ctrl", "command": "cmd", "windows": "win"}
+
+def _parse_keys(combo: str) -> List[str]:
+    return [_KEY_MAP.get(k, k) for k in combo.lower().split('+')]
+
+# Chromium profile reused across runs: cookies, sessions and HTTP cache survive, so warm starts
+# skip the Google sign-in subflow (delete the directory for a cold start)
+PROFILE_DIR = os.environ.get("AGENT_PROFILE_DIR", os.path.expanduser("~/.privacyuiagent_profile"))
 
 # --- Playwright Global State ---
 playwright_context: Dict[str, Any] = {
     "playwright": None,
-    "browser": None,
+    "context": None,
     "page": None,
 }
 
+# Last frame sent to the model: if the next capture hashes the same, its encoded bytes are
+# reused (skips resize + JPEG encode) and the ack is flagged screen_changed=False.
+_shot_cache: Dict[str, Any] = {"hash": None, "bytes": None, "unchanged": False}
+
+# (page url, label) -> locator strategy that last clicked it, e.g. "dialog_role".
+# Lets repeat clicks on the same screen skip the full probe sequence in ui_click_label.
+_locator_cache: Dict[Tuple[str, str], str] = {}
+
 # --- Helper Functions ---
 def current_page_url() -> str:
     try:
@@ -92,39 +204,128 @@ def _extract_safety_decision(fc):
     return None
 
 
-def _get_function_call_id(part) -> str:
+def _get_function_call_id(part) -> Optional[str]:
+    # Attribute walks only: serializing the part via to_dict() would also encode any
+    # attached screenshot just to read an id.
+    fc = getattr(part, "function_call", None)
+    return (
+        getattr(fc, "id", None)
+        or getattr(part, "id", None)
+        or getattr(part, "function_call_id", None)
+        or None
+    )
+
+def _screencapture_jpeg() -> bytes:
+    """Grab the screen as JPEG directly from macOS `screencapture` (no PNG round-trip)."""
+    fd, path = tempfile.mkstemp(suffix=".jpg")
+    os.close(fd)
     try:
-        fc = getattr(part, "function_call", None)
-        cid = getattr(fc, "id", None)
-        if cid:
-            return cid
-        cid = getattr(part, "id", None)
-        if cid:
-            return cid
-        cid = getattr(part, "function_call_id", None)
-        if cid:
-            return cid
-        if hasattr(part, "to_dict"):
-            d = part.to_dict()
-            cid = (
-                d.get("functionCall", {}, {}).get("id")
-                or d.get("function_call", {}, {}).get("id")
-                or d.get("id")
-            )
-            if cid:
-                return cid
-    except Exception:
-        pass
-    return None
+        subprocess.run(["screencapture", "-x", "-t", "jpg", path], check=True, capture_output=True)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _frame_digest(data: bytes) -> bytes:
+    if xxhash is not None:
+        return xxhash.xxh64(data).digest()
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+def _reuse_if_unchanged(digest: bytes) -> Optional[bytes]:
+    """Return the previous encoded frame if the screen hasn't changed since it was taken."""
+    unchanged = digest == _shot_cache["hash"]
+    _shot_cache["unchanged"] = unchanged
+    return _shot_cache["bytes"] if unchanged else None
+
+# mss handles are bound to the thread that opened them (X11 display, GDI DCs), and screenshots
+# are taken both on the main thread and in _executor, so each thread keeps its own grabber.
+_mss_local = threading.local()
+
+def _mss_grabber():
+    if mss is None:
+        return None
+    sct = getattr(_mss_local, "sct", None)
+    if sct is None:
+        sct = _mss_local.sct = mss.mss()
+    return sct
 
 def get_screenshot_bytes() -> bytes:
-    screenshot = pyautogui.screenshot()
+    from PIL import Image
+
+    if IS_DARWIN:
+        raw = _screencapture_jpeg()
+        digest = _frame_digest(raw)
+        cached = _reuse_if_unchanged(digest)
+        if cached is not None:
+            return cached
+        screenshot = Image.open(io.BytesIO(raw))
+        if max(screenshot.size) <= SCREENSHOT_MAX_DIM:
+            _shot_cache.update(hash=digest, bytes=raw)
+            return raw
+        # Let libjpeg decode at a reduced DCT scale instead of inflating the full Retina frame.
+        scale = SCREENSHOT_MAX_DIM / max(screenshot.size)
+        screenshot.draft("RGB", (int(screenshot.width * scale), int(screenshot.height * scale)))
+    else:
+        sct = _mss_grabber()
+        if sct is not None:
+            grab = sct.grab(sct.monitors[1])
+            frame = grab.bgra
+        else:
+            screenshot = pyautogui.screenshot()
+            frame = screenshot.tobytes()
+        digest = _frame_digest(frame)
+        cached = _reuse_if_unchanged(digest)
+        if cached is not None:
+            return cached
+        if sct is not None:
+            # Decode BGRA straight into RGB; skips mss's pure-Python .rgb conversion.
+            screenshot = Image.frombytes("RGB", grab.size, frame, "raw", "BGRX")
+
+    # The model works on the 0-1000 cuse_grid and _XSCALE/_YSCALE map back to SCREEN_WIDTH/HEIGHT,
+    # so native resolution buys nothing but bytes and vision tokens.
+    scale = SCREENSHOT_MAX_DIM / max(screenshot.size)
+    if scale < 1.0:
+        screenshot = screenshot.resize(
+            (int(screenshot.width * scale), int(screenshot.height * scale)), Image.BILINEAR
+        )
     img_byte_arr = io.BytesIO()
-    screenshot.save(img_byte_arr, format='PNG')
-    return img_byte_arr.getvalue()
+    screenshot.convert('RGB').save(img_byte_arr, format='JPEG', quality=SCREENSHOT_JPEG_QUALITY, optimize=False)
+    data = img_byte_arr.getvalue()
+    _shot_cache.update(hash=digest, bytes=data)
+    return data
+
+def _viewport_point(x: int, y: int):
+    """Map a screen point to CSS px in the active page's viewport.
+
+    Returns None (caller falls back to pyautogui) when there is no page, the browser
+    window isn't focused (e.g. the Zoom desktop app or an OS dialog is in front), or
+    the point lands on browser chrome rather than page content.
+    """
+    pg = playwright_context.get("page")
+    if not pg:
+        return None
+    try:
+        focused, left, top, width, height = pg.evaluate("""() => {
+            const side = (window.outerWidth - window.innerWidth) / 2;
+            return [document.hasFocus(),
+                    window.screenX + side,
+                    window.screenY + (window.outerHeight - window.innerHeight) - side,
+                    window.innerWidth, window.innerHeight];
+        }""")
+    except Exception:
+        return None
+    vx, vy = x - left, y - top
+    if focused and 0 <= vx < width and 0 <= vy < height:
+        return vx, vy
+    return None
 
-def denormalize(value: int, max_value: int) -> int:
-    return int((value * max_value) / cuse_grid)
+def _dialog_locator(pg: "Page"):
+    # Locators are lazy (no browser round-trip until used), so there's nothing to gain by
+    # caching the object itself; this just keeps every dialog-scoped lookup identical.
+    return pg.get_by_role("dialog").first
 
 # --- Playwright semantic click helper (dialog-aware; avoids coord clicks) ---
 def pw_click_button_by_text(text: str, timeout_ms: int = 5000) -> dict:
@@ -135,7 +336,7 @@ def pw_click_button_by_text(text: str, timeout_ms: int = 5000) -> dict:
 
         # 1) Prefer modal/dialog scope if present (prevents overlay intercepts)
         try:
-            dialog = pg.get_by_role("dialog").filter(has_text=re.compile(r".*", re.S)).first
+            dialog = _dialog_locator(pg)
             dialog.wait_for(state="visible", timeout=1500)
             btn = dialog.get_by_role("button", name=text, exact=True)
             if btn.count():
@@ -156,31 +357,40 @@ def pw_click_button_by_text(text: str, timeout_ms: int = 5000) -> dict:
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+def _launch_browser(p):
+    """Open the persistent-profile context; Chromium writes session state to PROFILE_DIR itself."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    context = p.chromium.launch_persistent_context(
+        user_data_dir=PROFILE_DIR,
+        headless=False,
+        # No emulated viewport: the page gets the real window size, so inner/outer window
+        # metrics in _viewport_point reflect the actual toolbar height. (Playwright rejects
+        # device_scale_factor without a viewport; the window-size flag below sets the size.)
+        no_viewport=True,
+        args=[
+            "--disable-features=IsolateOrigins,site-per-process",
+            f"--window-position=0,0",
+            f"--window-size={SCREEN_WIDTH},{SCREEN_HEIGHT}",
+        ],
+        timeout=30_000,
+    )
+    context.on("page", _watch_navigation)
+    for pg in context.pages:
+        _watch_navigation(pg)
+    return context
+
 def open_browser_and_navigate(url: str) -> Dict[str, str]:
     try:
         p = playwright_context.get("playwright")
         if not p:
             return {"status": "error", "message": "Playwright not initialized."}
 
-        win_w, win_h = SCREEN_WIDTH, SCREEN_HEIGHT
-        browser = p.chromium.launch(
-            headless=False,
-            args=[
-                "--disable-features=IsolateOrigins,site-per-process",
-                f"--window-position=0,0",
-                f"--window-size={win_w},{win_h}",
-            ],
-        )
-
-        context = browser.new_context(
-            viewport={"width": win_w, "height": win_h},
-            device_scale_factor=1.0,
-        )
-        page = context.new_page()
+        # Reuse the context pre-launched during planning, if any.
+        context = playwright_context.get("context") or _launch_browser(p)
+        page = context.pages[0] if context.pages else context.new_page()
         page.bring_to_front()
-        page.goto(url, wait_until="load", timeout=60_000)
+        page.goto(url, wait_until="domcontentloaded", timeout=30_000)
 
-        playwright_context["browser"] = browser
         playwright_context["page"] = page
         playwright_context["context"] = context
 
@@ -195,7 +405,7 @@ def pw_navigate(url: str) -> Dict[str, str]:
         if not pg:
             return {"status": "error", "message": "No active page"}
         pg.bring_to_front()
-        pg.goto(url, wait_until="load", timeout=60_000)
+        pg.goto(url, wait_until="domcontentloaded", timeout=30_000)
         return {"status": "success", "url": pg.url}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -207,7 +417,7 @@ def pw_go_back(steps: int = 1) -> Dict[str, str]:
             return {"status": "error", "message": "No active page"}
         pg.bring_to_front()
         for _ in range(max(1, steps)):
-            pg.go_back(wait_until="load", timeout=60_000)
+            pg.go_back(wait_until="domcontentloaded", timeout=30_000)
         return {"status": "success", "url": pg.url}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -218,7 +428,7 @@ def tabs_open_new(url: str) -> Dict[str, str]:
         if not ctx:
             return {"status": "error", "message": "No active context"}
         p = ctx.new_page()
-        p.goto(url, wait_until="load", timeout=60_000)
+        p.goto(url, wait_until="domcontentloaded", timeout=30_000)
         p.bring_to_front()
         playwright_context["page"] = p
         return {"status": "success", "url": p.url}
@@ -231,15 +441,31 @@ def tabs_switch_to(substr: str, timeout_ms: int = 10000) -> Dict[str, str]:
         ctx = playwright_context.get("context")
         if not ctx:
             return {"status": "error", "message": "No active context"}
-        deadline = time.time() + (timeout_ms/1000.0)
-        while time.time() < deadline:
+        needle = substr.lower()
+
+        def _find():
             for p in ctx.pages:
-                if substr.lower() in (p.url or "").lower():
-                    p.bring_to_front()
-                    playwright_context["page"] = p
-                    return {"status": "success", "url": p.url}
-            time.sleep(0.2)
-        return {"status": "error", "message": f"No tab containing '{substr}'"}
+                if needle in (p.url or "").lower():
+                    return p
+            return None
+
+        deadline = time.time() + (timeout_ms/1000.0)
+        match = _find()
+        while match is None:
+            remaining_ms = (deadline - time.time()) * 1000
+            if remaining_ms <= 0:
+                return {"status": "error", "message": f"No tab containing '{substr}'"}
+            try:
+                # Wake as soon as a tab opens. New tabs usually start at about:blank, so wait for
+                # the document before matching; the 1s slice also catches in-place navigations.
+                new_page = ctx.wait_for_event("page", timeout=min(remaining_ms, 1000))
+                new_page.wait_for_load_state("domcontentloaded", timeout=max(1, int((deadline - time.time()) * 1000)))
+            except Exception:
+                pass
+            match = _find()
+        match.bring_to_front()
+        playwright_context["page"] = match
+        return {"status": "success", "url": match.url}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -256,13 +482,96 @@ def save_consent_screenshot() -> Dict[str, Any]:
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+def _any_label_locator(scope, labels: List[str]):
+    combined = None
+    for lbl in labels:
+        loc = scope.get_by_role("button", name=lbl, exact=True).or_(scope.get_by_role("link", name=lbl, exact=True))
+        combined = loc if combined is None else combined.or_(loc)
+    return combined
+
+def _click_any_role_label(labels, timeout_ms: int, text_fallback: bool = False) -> Optional[dict]:
+    """Click a visible button/link matching one of `labels`, dialog before page.
+
+    One wait (up to timeout_ms) on a compound locator covers every label, so a modal that is
+    still animating in is waited for. Then the first label in list order that is visible gets
+    clicked, so list order is the priority. With text_fallback, plain text= matches (for
+    non-button controls) also count, after all button/link matches. Returns None if nothing matched."""
+    pg: Page = playwright_context.get("page")
+    if not pg or not labels:
+        return None
+    try:
+        dialog = _dialog_locator(pg)
+        try:
+            dialog.wait_for(state="visible", timeout=1200)
+            scopes = [("dialog", dialog), ("page", pg)]
+        except Exception:
+            scopes = [("page", pg)]
+
+        any_loc = None
+        for _, scope in scopes:
+            loc = _any_label_locator(scope, labels)
+            any_loc = loc if any_loc is None else any_loc.or_(loc)
+        if text_fallback:
+            for lbl in labels:
+                any_loc = any_loc.or_(pg.locator(f"text={lbl}"))
+        try:
+            any_loc.first.wait_for(state="visible", timeout=timeout_ms)
+        except Exception:
+            return None
+
+        for scope_name, scope in scopes:
+            for lbl in labels:
+                for role in ("button", "link"):
+                    loc = scope.get_by_role(role, name=lbl, exact=True).first
+                    if loc.is_visible():
+                        loc.click(timeout=timeout_ms)
+                        return {"status": "success", "scope": scope_name, "clicked": lbl}
+        if text_fallback:
+            for lbl in labels:
+                loc = pg.locator(f"text={lbl}").first
+                if loc.is_visible():
+                    loc.click(timeout=timeout_ms)
+                    return {"status": "success", "scope": "text", "clicked": lbl}
+    except Exception:
+        pass
+    return None
+
 def ui_click_any_label(labels: List[str], timeout_ms: int = 5000) -> dict:
+    r = _click_any_role_label(labels, timeout_ms)
+    if r:
+        return r
+    # Text-locator fallback, one label at a time
     for lbl in labels:
         r = ui_click_label(lbl, timeout_ms)
         if r.get("status") == "success":
             return r
     return {"status": "error", "message": f"No label matched from {labels}"}
 
+def _label_locator(pg: "Page", strategy: str, label: str):
+    scope_name, kind = strategy.split("_", 1)
+    scope = _dialog_locator(pg) if scope_name == "dialog" else pg
+    if kind == "text":
+        return scope.locator(f"text={label}")
+    # button|link resolved in one query; text stays a separate, lower-priority fallback
+    # because a loose text match (e.g. a heading) can precede the real control in DOM order.
+    return scope.get_by_role("button", name=label, exact=True).or_(
+        scope.get_by_role("link", name=label, exact=True)
+    )
+
+def _evict_stale_locators(frame) -> None:
+    """framenavigated hook: drop cached strategies recorded for other URLs."""
+    try:
+        if frame != frame.page.main_frame:
+            return
+        url = frame.url
+        for key in [k for k in _locator_cache if k[0] != url]:
+            _locator_cache.pop(key, None)
+    except Exception:
+        pass
+
+def _watch_navigation(page) -> None:
+    page.on("framenavigated", _evict_stale_locators)
+
 def ui_click_label(label: str, timeout_ms: int = 5000) -> dict:
     """Click a visible control by label, preferring dialog scope. Works for buttons/links/text."""
     try:
@@ -270,30 +579,38 @@ def ui_click_label(label: str, timeout_ms: int = 5000) -> dict:
         if not pg:
             return {"status": "error", "message": "No active page"}
 
+        # 0) Replay the strategy that worked last time on this URL
+        key = (pg.url, label)
+        cached = _locator_cache.get(key)
+        if cached:
+            try:
+                loc = _label_locator(pg, cached, label).first
+                loc.wait_for(state="visible", timeout=min(timeout_ms, 1500))
+                loc.click(timeout=timeout_ms)
+                return {"status": "success", "scope": cached.split("_", 1)[0], "clicked": label}
+            except Exception:
+                _locator_cache.pop(key, None)
+
         # 1) Try dialog-scope first
         try:
-            dialog = pg.get_by_role("dialog").first
+            dialog = _dialog_locator(pg)
             dialog.wait_for(state="visible", timeout=1200)
-            for locator in [
-                dialog.get_by_role("button", name=label, exact=True),
-                dialog.get_by_role("link", name=label, exact=True),
-                dialog.locator(f"text={label}")
-            ]:
+            for strategy in ("dialog_role", "dialog_text"):
+                locator = _label_locator(pg, strategy, label)
                 if locator.count():
                     locator.first.click(timeout=timeout_ms)
+                    _locator_cache[key] = strategy
                     return {"status": "success", "scope": "dialog", "clicked": label}
         except Exception:
             pass
 
         # 2) Fallback to page scope
-        for locator in [
-            pg.get_by_role("button", name=label, exact=True),
-            pg.get_by_role("link", name=label, exact=True),
-            pg.locator(f"text={label}")
-        ]:
+        for strategy in ("page_role", "page_text"):
+            locator = _label_locator(pg, strategy, label)
             if locator.count():
                 locator.first.wait_for(state="visible", timeout=timeout_ms)
                 locator.first.click(timeout=timeout_ms)
+                _locator_cache[key] = strategy
                 return {"status": "success", "scope": "page", "clicked": label}
 
         return {"status": "error", "message": f"Label not found: {label}"}
@@ -316,30 +633,388 @@ def provide_signup_password() -> Dict[str, str]:
         return {"status": "error", "message": "No SIGNUP_EMAIL_PASSWORD_WEB or SIGNUP_EMAIL_PASSWORD found"}
     return {"status": "success", "password": pwd_web}
 
+# Labels the gated-click shim tries on zoom.us/account, in priority order
+_MODAL_SHIM_LABELS = ("Send Code", "Terminate my account", "Delete", "Confirm")
+
+# ASCII console prefixes: cp1252/cp437 consoles can't encode emoji and fall back on every print
+_AGENT_PREFIX = "[Agent]"
+_PLAN_PREFIX = "[Plan]"
+
+# --- Canned recovery nudges (static; appended by reference when the model stalls) ---
+_ACCOUNT_NUDGE_CONTENT = Content(role="user", parts=[Part(text=(
+    "If Account Profile is not visible in the left navigation, use your built-in mouse wheel "
+    "to perform small repeated scrolls within the left nav until you can see and click "
+    "“Account Profile”. Re-scan the left nav after each small scroll."
+))])
+
+# --- Chat history compaction ---
+KEEP_SCREENSHOTS = 2  # most recent screenshots kept inline; older ones become text placeholders
+
+def _prune_history_screenshots(history: List[Content], keep: int = KEEP_SCREENSHOTS) -> None:
+    """Strip all but the newest `keep` screenshots from history, in place.
+
+    Every turn re-sends the whole history, so without this the upload grows with the
+    square of the turn count. Function calls/responses themselves are left intact so
+    the id pairing the tool protocol relies on is unaffected.
+    """
+    seen = 0
+    for turn in range(len(history) - 1, -1, -1):
+        parts = history[turn].parts or []
+        for j in range(len(parts) - 1, -1, -1):
+            part = parts[j]
+            if getattr(part, "inline_data", None):
+                seen += 1
+                if seen > keep:
+                    parts[j] = Part(text=f"[screenshot omitted, turn {turn}]")
+                continue
+            fr = getattr(part, "function_response", None)
+            if fr and any(getattr(fp, "inline_data", None) for fp in (fr.parts or [])):
+                seen += 1
+                if seen > keep:
+                    fr.parts = None
+                    fr.response = {**(fr.response or {}), "screenshot": f"omitted (turn {turn})"}
+
+HISTORY_KEEP_LAST = 6  # action/response pairs kept verbatim; older ones are folded into a summary
+_SUMMARY_PREFIX = "Earlier steps (summarized): "
+
+def _summarize_turns(contents: List[Content]) -> List[str]:
+    """Compact 'tool(arg)=status' entries for the function calls/responses in `contents`."""
+    call_args: Dict[str, str] = {}
+    entries: List[str] = []
+    for c in contents:
+        for part in c.parts or []:
+            text = getattr(part, "text", None) or ""
+            if text.startswith(_SUMMARY_PREFIX):
+                entries.extend(e for e in text[len(_SUMMARY_PREFIX):].split(", ") if e)
+                continue
+            fc = getattr(part, "function_call", None)
+            if fc:
+                args = getattr(fc, "args", None) or {}
+                brief = next((str(args[k]) for k in ("label", "text", "url", "keys", "substr") if args.get(k)), "")
+                call_args[getattr(fc, "id", None) or fc.name] = brief[:40]
+                continue
+            fr = getattr(part, "function_response", None)
+            if fr:
+                resp = fr.response or {}
+                res = resp.get("result") if isinstance(resp.get("result"), dict) else resp
+                status = res.get("status") or ("error" if res.get("error") else "ok")
+                brief = call_args.get(fr.id or fr.name, "")
+                entries.append(f"{fr.name}({brief})={status}")
+    return entries
+
+def _compact_history(history: List[Content], keep_last: int = HISTORY_KEEP_LAST) -> None:
+    """Keep the opening user turn (goal, plan) and the last `keep_last` call/response pairs;
+    replace everything between with a single summary turn, in place."""
+    if len(history) <= keep_last * 2 + 2:
+        return
+    cut = len(history) - keep_last * 2
+    # The kept tail must open on a model turn so every function response still follows its call.
+    while cut < len(history) and history[cut].role != "model":
+        cut += 1
+    if cut <= 2 or cut >= len(history):
+        return
+    summary = _SUMMARY_PREFIX + ", ".join(_summarize_turns(history[1:cut]))
+    history[1:cut] = [Content(role="user", parts=[Part(text=summary)])]
+
 # --- Action Execution Loop ---
+def _is_plain_text_part(part) -> bool:
+    return bool(getattr(part, "text", None)) and not getattr(part, "function_call", None) \
+        and not getattr(part, "thought_signature", None)
+
+def _collect_stream(stream):
+    """Accumulate a generate_content_stream into one response shaped like generate_content's."""
+    parts = []
+    last = None
+    for chunk in stream:
+        last = chunk
+        cands = getattr(chunk, "candidates", None) or []
+        content = getattr(cands[0], "content", None) if cands else None
+        for part in (getattr(content, "parts", None) or []):
+            # Text arrives in fragments; glue consecutive plain-text fragments back together.
+            if parts and _is_plain_text_part(part) and _is_plain_text_part(parts[-1]):
+                parts[-1] = Part(text=parts[-1].text + part.text)
+            else:
+                parts.append(part)
+    if last is None or not parts:
+        return last
+    last_cand = last.candidates[0] if last.candidates else None
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(
+            content=Content(role="model", parts=parts),
+            finish_reason=getattr(last_cand, "finish_reason", None),
+        )],
+        usage_metadata=getattr(last, "usage_metadata", None),
+    )
+
+def _generate_once(client, model, contents, config):
+    stream = client.models.generate_content_stream(model=model, contents=contents, config=config)
+    return _collect_stream(stream)
+
+def _generate_hedged(client, model, contents, config):
+    """Send the request; if it stalls past MODEL_HEDGE_AFTER_S, send a duplicate and take the first good answer.
+
+    Safe because the request is a pure read of the same conversation. Losers can't be
+    interrupted mid-flight (threads), their results are simply dropped.
+    """
+    contents = list(contents)  # snapshot: the caller keeps appending to chat_history
+    first = _executor.submit(_generate_once, client, model, contents, config)
+    done, _ = wait([first], timeout=MODEL_HEDGE_AFTER_S)
+    if done:
+        return first.result()
+
+    print(f"[Model call] no response after {MODEL_HEDGE_AFTER_S:.0f}s; sending hedge request")
+    pending = {first, _executor.submit(_generate_once, client, model, contents, config)}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return fut.result()
+    return first.result()  # both failed: surface the original error to the retry loop
+
+RETRY_BASE_DELAY_S = 0.3
+RETRY_MAX_DELAY_S = 3.0
+_NON_RETRYABLE_MARKERS = ("PERMISSION_DENIED", "UNAUTHENTICATED", "API_KEY_INVALID")
+
+def _is_retryable(e: Exception) -> bool:
+    """Client errors (auth, bad request) fail the same way every time; 408/429 and 5xx may not."""
+    code = getattr(e, "code", None)
+    if isinstance(code, int) and 400 <= code < 500 and code not in (408, 429):
+        return False
+    return not any(m in str(e) for m in _NON_RETRYABLE_MARKERS)
+
 def call_model_with_retries(client, model, contents, config, max_retries=4):
-    delay = 1.0
+    delay = RETRY_BASE_DELAY_S
     for attempt in range(1, max_retries + 1):
         try:
-            resp = client.models.generate_content(model=model, contents=contents, config=config)
+            resp = _generate_hedged(client, model, contents, config)
             return True, resp
         except Exception as e:
             err = str(e)
             print(f"[Model call error] attempt {attempt}/{max_retries}: {err}")
-            if attempt == max_retries:
+            if attempt == max_retries or not _is_retryable(e):
                 return False, err
-            time.sleep(delay + random.uniform(0, 0.5))
-            delay *= 2
+            time.sleep(delay + random.uniform(0, delay / 2))
+            delay = min(delay * 2, RETRY_MAX_DELAY_S)
+
+# --- Tool handlers: each takes the call's args and returns the action_result dict ---
+def _do_click_at(args: dict) -> dict:
+    x = int(args["x"] * _XSCALE)
+    y = int(args["y"] * _YSCALE)
+    vp = _viewport_point(x, y)
+    if vp:
+        playwright_context["page"].mouse.click(*vp)
+    else:
+        pyautogui.click(x, y, duration=0)
+    return {"status": "success", "x": x, "y": y, "via": "playwright" if vp else "os"}
+
+def _is_secret(text: str) -> bool:
+    """True if `text` contains the signup email or password handed to the model."""
+    secrets = (os.environ.get(k, "").strip() for k in
+               ("SIGNUP_EMAIL_ADDRESS", "SIGNUP_EMAIL_PASSWORD_WEB", "SIGNUP_EMAIL_PASSWORD"))
+    return any(sec and sec in text for sec in secrets)
+
+def _pasted_value_landed(text: str) -> bool:
+    """Poll the focused field of the active page until it contains `text`. False when there is
+    no focused page to observe (e.g. a desktop app has focus) or the value never shows up."""
+    pg = playwright_context.get("page")
+    if not pg:
+        return False
+    deadline = time.time() + PASTE_CONFIRM_S
+    while time.time() < deadline:
+        try:
+            landed = pg.evaluate("""(t) => {
+                if (!document.hasFocus()) return null;
+                const el = document.activeElement;
+                if (!el) return false;
+                const v = ("value" in el) ? el.value : el.textContent;
+                return (v || "").includes(t);
+            }""", text)
+        except Exception:
+            return False
+        if landed is None:
+            return False  # page not focused: the paste went elsewhere, nothing to observe
+        if landed:
+            return True
+        time.sleep(0.05)
+    return False
+
+def _os_paste_or_type(text: str) -> None:
+    """Enter text at the OS focus. Typed per char by default; with PASTE_TEXT, non-secret text
+    goes in as one clipboard paste. The user's clipboard is restored only once the pasted value
+    is seen in the focused field, so a slow app can't paste the old contents instead."""
+    if not PASTE_TEXT or pyperclip is None or len(text) < PASTE_MIN_LEN or _is_secret(text):
+        pyautogui.write(text, interval=0.01)
+        return
+    try:
+        previous = pyperclip.paste()
+    except Exception:
+        previous = None
+    try:
+        pyperclip.copy(text)
+        pyautogui.hotkey(*PASTE_KEYS)
+    except Exception:
+        pyautogui.write(text, interval=0.01)
+        return
+    # pyperclip only sees text; '' may mean the clipboard held an image/file, so leave it alone.
+    # If the paste can't be confirmed, the pasted text stays on the clipboard rather than racing it.
+    if previous and _pasted_value_landed(text):
+        try:
+            pyperclip.copy(previous)
+        except Exception:
+            pass
 
-def execute_function_calls(candidate) -> List[Tuple[str, Dict, FunctionCall]]:
+def _do_type_text_at(args: dict) -> dict:
+    x = int(args["x"] * _XSCALE)
+    y = int(args["y"] * _YSCALE)
+    text = args["text"]
+    press_enter = args.get("press_enter", False)
+    vp = _viewport_point(x, y)
+    if vp:
+        pg = playwright_context["page"]
+        pg.mouse.click(*vp)
+        pg.keyboard.press(SELECT_ALL_CHORD)
+        pg.keyboard.press("Backspace")
+        pg.keyboard.type(text, delay=0)
+        if press_enter:
+            pg.keyboard.press("Enter")
+    else:
+        pyautogui.click(x, y)
+        pyautogui.hotkey(*SELECT_ALL_KEYS)
+        pyautogui.press('backspace')
+        _os_paste_or_type(text)
+        if press_enter:
+            pyautogui.press('enter')
+    return {"status": "success", "typed_len": len(text), "press_enter": press_enter,
+            "via": "playwright" if vp else "os"}
+
+def _do_key_combination(args: dict) -> dict:
+    mapped_keys = _parse_keys(args["keys"])
+    pyautogui.hotkey(*mapped_keys)
+    return {"status": "success", "keys": mapped_keys}
+
+def _do_wait_5_seconds(args: dict) -> dict:
+    time.sleep(5)
+    return {"status": "success"}
+
+def _do_scroll_at(args: dict) -> dict:
+    x = int(args.get("x", 500) * _XSCALE)
+    y = int(args.get("y", 500) * _YSCALE)
+    direction = (args.get("direction") or "down").lower()
+    magnitude = int(args.get("magnitude", 200))
+    pyautogui.scroll(-magnitude if direction == "down" else magnitude, x=x, y=y)
+    return {"status": "success", "scrolled": direction, "magnitude": magnitude, "x": x, "y": y}
+
+def _do_wheel(args: dict) -> dict:
+    dy = int(args.get("dy", args.get("magnitude", 200)))
+    direction = "down" if dy > 0 else "up"
+    x = int(args.get("x", 500) * _XSCALE)
+    y = int(args.get("y", 500) * _YSCALE)
+    pyautogui.scroll(-abs(dy) if direction == "down" else abs(dy), x=x, y=y)
+    return {"status": "success", "scrolled": direction, "magnitude": abs(dy), "x": x, "y": y}
+
+def _do_scroll_document(args: dict) -> dict:
+    direction = (args.get("direction") or "down").lower()
+    magnitude = int(args.get("magnitude", 300))
+    x = int(args.get("x", 500) * _XSCALE)
+    y = int(args.get("y", 600) * _YSCALE)
+    pyautogui.scroll(-abs(magnitude) if direction == "down" else abs(magnitude), x=x, y=y)
+    return {"status": "success", "scrolled": direction, "magnitude": magnitude, "x": x, "y": y}
+
+# Primitives batch_actions may chain; each step's fields are that action's own args.
+# No click_at: the built-in safety_decision gating (see execute_function_calls) only sees
+# top-level Computer Use calls, so coordinate clicks must never be hidden inside a batch.
+_BATCHABLE_ACTIONS = ("type_text_at", "key_combination")
+
+_TEXT_FIELD_AT_POINT_JS = """([x, y]) => {
+    const el = document.elementFromPoint(x, y);
+    if (!el) return false;
+    if (el.isContentEditable || el.tagName === "TEXTAREA") return true;
+    if (el.tagName !== "INPUT") return false;
+    const t = (el.getAttribute("type") || "text").toLowerCase();
+    return !["button", "submit", "reset", "image", "checkbox", "radio", "file", "range", "color"].includes(t);
+}"""
+
+def _point_is_text_field(x: int, y: int) -> bool:
+    """True if the screen point is over a text input in the active page, so the focusing
+    click of a batched type_text_at can't press a button or link."""
+    vp = _viewport_point(x, y)
+    if not vp:
+        return False
+    try:
+        return bool(playwright_context["page"].evaluate(_TEXT_FIELD_AT_POINT_JS, list(vp)))
+    except Exception:
+        return False
+
+def _batch_refusal(actions: list) -> Optional[str]:
+    """Why the batch may not run, or None. Checked for every step before any of them runs."""
+    for i, step in enumerate(actions):
+        name = step.get("action")
+        if name not in _BATCHABLE_ACTIONS:
+            return f"step {i}: {name} is not batchable; send it as its own call"
+        if step.get("safety_decision") or step.get("safetyDecision"):
+            return f"step {i}: carries a safety_decision; send it as its own call"
+        if name == "type_text_at" and not _point_is_text_field(int(step.get("x", 0) * _XSCALE),
+                                                               int(step.get("y", 0) * _YSCALE)):
+            return f"step {i}: ({step.get('x')}, {step.get('y')}) is not a text field in the page"
+    return None
+
+def _do_batch_actions(args: dict) -> dict:
+    """Run several typing/key primitives back to back; the caller takes one screenshot afterwards.
+    Refuses the whole batch if any step could bypass safety gating. Otherwise stops at the
+    first failing step so the model sees how far the batch got."""
+    actions = args.get("actions") or []
+    refusal = _batch_refusal(actions)
+    if refusal:
+        return {"status": "error", "completed": 0, "message": f"Batch refused, nothing was run: {refusal}"}
+    steps = []
+    for step in actions:
+        name = step.get("action")
+        try:
+            r = DISPATCH[name](step)
+        except Exception as e:
+            r = {"status": "error", "message": str(e)}
+        steps.append({"action": name, **r})
+        if r.get("status") != "success":
+            break
+    ok = len(steps) == len(actions) and all(st.get("status") == "success" for st in steps)
+    return {"status": "success" if ok else "error", "completed": sum(st.get("status") == "success" for st in steps),
+            "steps": steps}
+
+DISPATCH: Dict[str, Callable[[dict], dict]] = {
+    # Built-in Computer Use actions
+    "click_at": _do_click_at,
+    "type_text_at": _do_type_text_at,
+    "key_combination": _do_key_combination,
+    "wait_5_seconds": _do_wait_5_seconds,
+    "scroll_at": _do_scroll_at,
+    "wheel": _do_wheel,
+    "page_scroll": _do_wheel,
+    "scroll_document": _do_scroll_document,
+    # Custom Tools / Navigation
+    "open_browser_and_navigate": lambda args: open_browser_and_navigate(args["url"]),
+    "save_consent_screenshot": lambda args: save_consent_screenshot(),
+    "provide_signup_email": lambda args: provide_signup_email(),
+    "provide_signup_password": lambda args: provide_signup_password(),
+    "pw_navigate": lambda args: pw_navigate(args["url"]),
+    "navigate": lambda args: pw_navigate(args["url"]),
+    "pw_go_back": lambda args: pw_go_back(int(args.get("steps", 1))),
+    "click_button_by_text": lambda args: pw_click_button_by_text(args["text"], int(args.get("timeout_ms", 5000))),
+    "ui_click_label": lambda args: ui_click_label(args["label"], int(args.get("timeout_ms", 5000))),
+    "ui_click_any_label": lambda args: ui_click_any_label(args["labels"], int(args.get("timeout_ms", 5000))),
+    "tabs_open_new": lambda args: tabs_open_new(args["url"]),
+    "tabs_switch_to": lambda args: tabs_switch_to(args["substr"], int(args.get("timeout_ms", 10000))),
+    "batch_actions": _do_batch_actions,
+}
+
+# Sentinel fname from execute_function_calls: a gated click_at was acked; ask for a text-based re-emit
+RETRY_WITH_TEXT = object()
+
+def execute_function_calls(fcall_parts: List[Part]) -> List[Tuple[Any, Dict, FunctionCall]]:
+    """Run the function-call parts of a model turn (already filtered by the caller)."""
     results = []
-    wrapped_calls = []
-    for p in candidate.content.parts:
-        fc = getattr(p, "function_call", None)
-        if not fc:
-            continue
-        call_id = _get_function_call_id(p)
-        wrapped_calls.append({"part": p, "fc": fc, "id": call_id})
+    wrapped_calls = [{"part": p, "fc": p.function_call, "id": _get_function_call_id(p)} for p in fcall_parts]
 
     # Detect gating
     any_gated = False
@@ -351,7 +1026,8 @@ def execute_function_calls(candidate) -> List[Tuple[str, Dict, FunctionCall]]:
         sd = _extract_safety_decision(fc)
         if sd and sd.get("decision") in ("require_confirmation", "block"):
             name = fc.name
-            call_id = wc["id"] or getattr(fc, "id", None) or f"gated-{int(time.time()*1000)}"
+            # wc["id"] already covers fc.id (see _get_function_call_id)
+            call_id = wc["id"] or f"gated-{next(_id_counter)}"
 
             # 1) Emit the required ack FunctionResponse
             results.append((
@@ -376,7 +1052,7 @@ def execute_function_calls(candidate) -> List[Tuple[str, Dict, FunctionCall]]:
             # 2) If it's a coordinate click, short-circuit and ask for a semantic re-emit
             if name == "click_at":
                 # Tell caller we handled ack, but want a re-emit w/ text-based tool
-                results.append(("__RETRY_WITH_TEXT__", {"reason": "gated_click_at"}, None))
+                results.append((RETRY_WITH_TEXT, {"reason": "gated_click_at"}, None))
             # Continue to next wrapped call (we don't execute the gated action now)
             continue
 
@@ -385,7 +1061,9 @@ def execute_function_calls(candidate) -> List[Tuple[str, Dict, FunctionCall]]:
         return results
 
 
-    # No safety ACKs → normal execution path
+    # No safety ACKs → normal execution path.
+    # Calls run strictly in order: pyautogui shares one mouse/keyboard and the sync Playwright
+    # objects may only be used from this thread, so there is no parallel-safe subset to batch.
     for wc in wrapped_calls:
         fc = wc["fc"]
         fname = fc.name
@@ -393,105 +1071,12 @@ def execute_function_calls(candidate) -> List[Tuple[str, Dict, FunctionCall]]:
         action_result = {}
         print(f"  Executing > {fname}({args})")
         try:
-            if fname == "click_at":
-                x = denormalize(args["x"], SCREEN_WIDTH)
-                y = denormalize(args["y"], SCREEN_HEIGHT)
-                pyautogui.moveTo(x, y, duration=0.3)
-                pyautogui.click()
-                action_result = {"status": "success", "x": x, "y": y}
-
-            elif fname == "type_text_at":
-                x = denormalize(args["x"], SCREEN_WIDTH)
-                y = denormalize(args["y"], SCREEN_HEIGHT)
-                text = args["text"]
-                press_enter = args.get("press_enter", False)
-                pyautogui.click(x, y)
-                if sys.platform == "darwin":
-                    pyautogui.hotkey('command', 'a')
-                else:
-                    pyautogui.hotkey('ctrl', 'a')
-                pyautogui.press('backspace')
-                pyautogui.write(text, interval=0.05)
-                if press_enter:
-                    pyautogui.press('enter')
-                action_result = {"status": "success", "typed_len": len(text), "press_enter": press_enter}
-
-            elif fname == "key_combination":
-                keys = args["keys"].lower().split('+')
-                key_map = {"control": "ctrl", "command": "cmd", "windows": "win"}
-                mapped_keys = [key_map.get(k, k) for k in keys]
-                pyautogui.hotkey(*mapped_keys)
-                action_result = {"status": "success", "keys": mapped_keys}
-
-            elif fname == "wait_5_seconds":
-                time.sleep(5)
-                action_result = {"status": "success"}
-
-            elif fname == "scroll_at":
-                x = denormalize(args.get("x", 500), SCREEN_WIDTH)
-                y = denormalize(args.get("y", 500), SCREEN_HEIGHT)
-                direction = (args.get("direction") or "down").lower()
-                magnitude = int(args.get("magnitude", 200))
-                pyautogui.moveTo(x, y, duration=0.2)
-                pyautogui.scroll(-magnitude if direction == "down" else magnitude)
-                action_result = {"status": "success", "scrolled": direction, "magnitude": magnitude, "x": x, "y": y}
-
-            elif fname in ("wheel", "page_scroll"):
-                dy = int(args.get("dy", args.get("magnitude", 200)))
-                direction = "down" if dy > 0 else "up"
-                x = denormalize(args.get("x", 500), SCREEN_WIDTH)
-                y = denormalize(args.get("y", 500), SCREEN_HEIGHT)
-                pyautogui.moveTo(x, y, duration=0.2)
-                pyautogui.scroll(-abs(dy) if direction == "down" else abs(dy))
-                action_result = {"status": "success", "scrolled": direction, "magnitude": abs(dy), "x": x, "y": y}
-
-            # --- Custom Tools / Navigation ---
-            elif fname == "open_browser_and_navigate":
-                action_result = open_browser_and_navigate(args["url"])
-
-            elif fname == "save_consent_screenshot":
-                action_result = save_consent_screenshot()
-
-            elif fname == "provide_signup_email":
-                action_result = provide_signup_email()
-
-            elif fname in ("pw_navigate", "navigate"):
-                action_result = pw_navigate(args["url"])
-
-            elif fname == "pw_go_back":
-                steps = int(args.get("steps", 1))
-                action_result = pw_go_back(steps)
-
-            elif fname == "provide_signup_password":
-                action_result = provide_signup_password()
-
-            elif fname == "scroll_document":
-                direction = (args.get("direction") or "down").lower()
-                magnitude = int(args.get("magnitude", 300))
-                x = denormalize(args.get("x", 500), SCREEN_WIDTH)
-                y = denormalize(args.get("y", 600), SCREEN_HEIGHT)
-                pyautogui.moveTo(x, y, duration=0.2)
-                pyautogui.scroll(-abs(magnitude) if direction == "down" else abs(magnitude))
-                action_result = {"status": "success", "scrolled": direction, "magnitude": magnitude, "x": x, "y": y}
-
-            elif fname == "click_button_by_text":
-                txt = args["text"]
-                to = int(args.get("timeout_ms", 5000))
-                action_result = pw_click_button_by_text(txt, to)
-            elif fname == "ui_click_label": 
-                action_result = ui_click_label(args["label"], int(args.get("timeout_ms", 5000)))
-            elif fname == "ui_click_any_label": 
-                action_result = ui_click_any_label(args["labels"], int(args.get("timeout_ms", 5000)))
-            elif fname == "tabs_open_new": 
-                action_result = tabs_open_new(args["url"])
-            elif fname == "tabs_switch_to": 
-                action_result = tabs_switch_to(args["substr"], int(args.get("timeout_ms", 10000)))
-
-
+            handler = DISPATCH.get(fname)
+            if handler:
+                action_result = handler(args)
             else:
                 print(f"Warning: Skipping unimplemented function {fname}")
                 action_result = {"error": f"Function {fname} not implemented locally."}
-
         except Exception as e:
             action_result = {"error": str(e)}
 
@@ -500,6 +1085,71 @@ def execute_function_calls(candidate) -> List[Tuple[str, Dict, FunctionCall]]:
 
     return results
 
+# Suffix for synthesized call ids: unique within the session, no clock syscall, no same-ms collisions
+_id_counter = itertools.count()
+
+# --- FunctionResponse builders: (fname, result, fcall, call_id, url, shot) -> FunctionResponse ---
+# `shot` is the Future of the turn's screenshot for the call that carries it, else None.
+def _build_ack_fr(fname, result, fcall, call_id, url, shot) -> FunctionResponse:
+    ack = result["safety_ack_payload"]
+    return types.FunctionResponse(id=ack["id"], name=ack["name"], response=ack["response"])
+
+def _build_deferred_fr(fname, result, fcall, call_id, url, shot) -> FunctionResponse:
+    return types.FunctionResponse(
+        id=call_id or f"deferred-{fname}-{next(_id_counter)}",
+        name=fname,
+        response={"status": "deferred_due_to_safety_ack"},
+    )
+
+def _build_exec_fr(fname, result, fcall, call_id, url, shot) -> FunctionResponse:
+    base_ack = {
+        "function_name": fname,
+        "acknowledged": True,
+        "url": url,
+        "page_url": url,
+        "result": result,  # normalized to a dict by _build_function_response
+    }
+    shot_parts = []
+    if shot is not None:
+        shot_parts = [types.FunctionResponsePart(
+            inline_data=types.FunctionResponseBlob(mime_type=SCREENSHOT_MIME_TYPE, data=shot.result())
+        )]
+        base_ack["screen_changed"] = not _shot_cache["unchanged"]
+    return types.FunctionResponse(
+        id=call_id or f"exec-{fname}-{next(_id_counter)}",
+        name=fname,
+        response=base_ack,
+        parts=shot_parts,
+    )
+
+def _fr_kind(result) -> str:
+    """Classify an action result with a single type check: 'ack', 'deferred' or 'exec'."""
+    rd = result if isinstance(result, dict) else None
+    if rd and rd.get("ack_only"):
+        return "ack"
+    if rd and rd.get("deferred"):
+        return "deferred"
+    return "exec"
+
+_FR_BUILDERS = {"ack": _build_ack_fr, "deferred": _build_deferred_fr, "exec": _build_exec_fr}
+
+def _build_function_response(item, url: str, shot: Optional[Future]) -> FunctionResponse:
+    """One FunctionResponse per execute_function_calls result; never raises."""
+    fname, result, fcall = item[:3]
+    # Resolve once; the builders and the error path below use call_id as-is.
+    call_id = (item[3] if len(item) == 4 else None) or getattr(fcall, "id", None)
+    try:
+        kind = _fr_kind(result)
+        if kind == "exec" and not isinstance(result, dict):
+            result = {"result": str(result)}
+        return _FR_BUILDERS[kind](fname, result, fcall, call_id, url, shot)
+    except Exception as e:
+        return types.FunctionResponse(
+            id=call_id or f"error-{fname}-{next(_id_counter)}",
+            name=fname if isinstance(fname, str) else None,
+            response={"status": "error", "message": f"builder_exception: {str(e)}"},
+        )
+
 # --- Planning (unchanged) ---
 def generate_plan(client, user_prompt: str, screenshot_bytes: bytes, config) -> str:
     planning_prompt = f"""
@@ -531,14 +1181,14 @@ Be specific about what buttons to click, what text to type, and what to look for
                 role="user",
                 parts=[
                     Part(text=planning_prompt),
-                    Part.from_bytes(data=screenshot_bytes, mime_type='image/png')
+                    Part.from_bytes(data=screenshot_bytes, mime_type=SCREENSHOT_MIME_TYPE)
                 ]
             )],
             config=planning_config
         )
         
         plan = response.candidates[0].content.parts[0].text
-        print(f"📋 Generated Plan:\n{plan}\n")
+        print(f"{_PLAN_PREFIX} Generated Plan:\n{plan}\n")
         return plan
         
     except Exception as e:
@@ -546,6 +1196,11 @@ Be specific about what buttons to click, what text to type, and what to look for
         return "PLAN:\n1. Analyze current screen and proceed step by step\n2. Adapt based on what is visible"
 
 def run_agent():
+    from playwright.sync_api import sync_playwright
+
+    # Open the TLS connection to the API while Playwright starts up.
+    _executor.submit(_warm_connection)
+
     with sync_playwright() as p:
         playwright_context["playwright"] = p
         
@@ -619,6 +1274,21 @@ def run_agent():
                 description="Switch to a tab whose URL contains the given substring.",
                 parameters={"type":"object","properties":{"substr":{"type":"string"},"timeout_ms":{"type":"integer","default":10000}},
                         "required":["substr"]}
+            ),
+            types.FunctionDeclaration(name="batch_actions",
+                description="Run several type_text_at / key_combination steps in order with ONE screenshot "
+                            "at the end (e.g. fill several form fields, then Tab or Enter). Coordinates use the same "
+                            "0-1000 grid and must point at text inputs in the browser page. No clicks: send click_at "
+                            "or click_button_by_text as separate calls. The whole batch is refused otherwise.",
+                parameters={"type":"object","properties":{"actions":{"type":"array","items":{
+                    "type":"object",
+                    "properties":{
+                        "action":{"type":"string","enum":list(_BATCHABLE_ACTIONS)},
+                        "x":{"type":"integer"},"y":{"type":"integer"},
+                        "text":{"type":"string"},"press_enter":{"type":"boolean"},
+                        "keys":{"type":"string","description":"e.g. 'Control+A'"}},
+                    "required":["action"]}}},
+                        "required":["actions"]}
             )
         ]
 
@@ -691,7 +1361,13 @@ Safety and accessibility
         print(f"\nGoal: {user_prompt}\n")
 
         initial_screenshot = get_screenshot_bytes()
-        plan = generate_plan(client, user_prompt, initial_screenshot, config)
+        # Plan on a worker thread while Chromium starts here (sync Playwright must stay on this thread).
+        plan_future = _executor.submit(generate_plan, client, user_prompt, initial_screenshot, config)
+        try:
+            playwright_context["context"] = _launch_browser(p)
+        except Exception as e:
+            print(f"[Browser prelaunch failed; will launch on demand] {e}")
+        plan = plan_future.result()
         
         planning_context = f"""
 I will now execute the following plan. I will perform all actions within the browser window.
@@ -702,17 +1378,18 @@ I will now execute the following plan. I will perform all actions within the bro
             Content(role="user", parts=[
                 Part(text=user_prompt),
                 Part(text=planning_context),
-                Part.from_bytes(data=initial_screenshot, mime_type='image/png')
+                Part.from_bytes(data=initial_screenshot, mime_type=SCREENSHOT_MIME_TYPE)
             ])
         ]
 
         # 3. Interaction Loop
         MAX_TURNS = 40
+        empty_retry_count = 0
         for turn in range(1, MAX_TURNS + 1):
             print(f"--- Turn {turn} ---")
-            time.sleep(2)
             print("Analyzing screen...")
             
+            # Called inline: nothing overlaps with it, and _generate_hedged already uses _executor
             ok, response = call_model_with_retries(client, MODEL_ID, chat_history, config)
             if not ok:
                 print(f"API Error (after retries): {response}")
@@ -721,50 +1398,44 @@ I will now execute the following plan. I will perform all actions within the bro
             cands = getattr(response, "candidates", None) or []
             if not cands:
                 print("No candidates returned; retrying next turn.")
-                time.sleep(1.0)
+                # Jittered exponential backoff: ~0.2s for a one-off empty, capped at 8s if degraded
+                time.sleep(min(0.2 * (2 ** empty_retry_count) + random.random() * 0.1, 8.0))
+                empty_retry_count += 1
                 continue
+            empty_retry_count = 0
 
             model_response = cands[0].content
             chat_history.append(model_response)
+            fcall_parts = [p for p in (model_response.parts or []) if p.function_call]
+            has_fcall = bool(fcall_parts)
 
             if model_response.parts and getattr(model_response.parts[0], "text", None):
-                print(f"🤖 Agent: {model_response.parts[0].text.strip()}")
+                print(_AGENT_PREFIX, model_response.parts[0].text.strip())
 
             # Nudge on Account Management if the model paused
-            if not any(p.function_call for p in model_response.parts):
+            if not has_fcall:
                 url_now = current_page_url() or ""
-                if ("account" in url_now.lower() and "management" in url_now.lower()) or "zoom.us/account" in url_now.lower():
-                    chat_history.append(Content(
-                        role="user",
-                        parts=[Part(text=(
-                            "If Account Profile is not visible in the left navigation, use your built-in mouse wheel "
-                            "to perform small repeated scrolls within the left nav until you can see and click "
-                            "“Account Profile”. Re-scan the left nav after each small scroll."
-                        ))]
-                    ))
+                url_lower = url_now.lower()
+                if ("account" in url_lower and "management" in url_lower) or "zoom.us/account" in url_lower:
+                    chat_history.append(_ACCOUNT_NUDGE_CONTENT)
                     continue
                 print("Agent finished or is waiting for input.")
                 break
 
-            if not any(p.function_call for p in model_response.parts):
-                url_now = (current_page_url() or "").lower()
-                if any(k in url_now for k in ["account", "settings", "terminate", "delete"]):
-                    chat_history.append(Content(role="user", parts=[Part(text=(
-                        "A modal may be present. Use ui_click_any_label on 'Send Code'"
-                        "then tabs_open_new to open the inbox, find the code from inside the latest email and copy it."
-                        "tabs_switch_to back to the site, paste the code, and ui_click_any_label "
-                        "on the deletion confirmation button."
-                    ))]))
-                    continue
+            action_results = execute_function_calls(fcall_parts)
 
-            action_results = execute_function_calls(response.candidates[0])
+            # Sentinel entries are signals for this loop, not calls; keep them away from the builders
+            retry_with_text = any(item[0] is RETRY_WITH_TEXT for item in action_results)
+            action_results = [item for item in action_results if item[0] is not RETRY_WITH_TEXT]
 
-            # If execute_function_calls asked for a retry via text, don't send FunctionResponses
-            if len(action_results) == 1 and action_results[0][0] == "__RETRY_WITH_TEXT__":
+            # A gated click_at was acked but not run: answer the acks and ask for a text-based re-emit
+            if retry_with_text:
+                ack_parts = [Part(function_response=_build_function_response(item, "", None))
+                             for item in action_results]
                 chat_history.append(Content(
                     role="user",
-                    parts=[Part(text=(
-                        "Safety requirement: I could not acknowledge your last tool call because it lacked a function_call.id. "
+                    parts=ack_parts + [Part(text=(
+                        "Safety requirement: your last coordinate click was safety-gated and was NOT executed. "
                         "Please re-issue the action without using coordinate-based clicks.\n\n"
                         "Specifically: do NOT use click_at. Instead, call the tool `click_button_by_text` "
                         "with the exact visible label (e.g., 'Create Account', 'Send Code', 'Delete'). "
@@ -776,103 +1447,41 @@ I will now execute the following plan. I will perform all actions within the bro
                     pg = playwright_context.get("page")
                     url_now = (pg.url or "") if pg else ""
                     if pg and "zoom.us/account" in url_now:
-                        for label in ["Send Code", "Terminate my account", "Delete", "Confirm"]:
-                            shim = pw_click_button_by_text(label, 8000)
-                            print(f"[Shim] {label}:", shim)
-                            if shim.get("status") == "success":
-                                break
+                        # One compound locator: bounded by a single 8s wait instead of up to four.
+                        shim = _click_any_role_label(_MODAL_SHIM_LABELS, 8000, text_fallback=True) or \
+                            {"status": "error", "message": f"None of {list(_MODAL_SHIM_LABELS)} found"}
+                        print("[Shim]", shim)
                 except Exception as e:
                     print("[Shim error]", e)
                 continue
 
             # Build FunctionResponses
-            function_response_parts = []
-            names_emitted = []
-
-            for item in action_results:
-                if len(item) == 4:
-                    fname, result, fcall, call_id = item
-                else:
-                    fname, result, fcall = item
-                    call_id = getattr(fcall, "id", None)
-
-                names_emitted.append(fname)
-
-                try:
-                    # Normalize response name: respond as pw_navigate if model used 'navigate'
-                    response_name = fname
-
-                    if isinstance(result, dict) and result.get("ack_only"):
-                        ack = result["safety_ack_payload"]
-                        rn = ack["name"]
-                        fr = types.FunctionResponse(
-                            id=ack["id"],
-                            name=rn,
-                            response=ack["response"],
-                        )
-                        function_response_parts.append(fr)
-
-                    elif isinstance(result, dict) and result.get("deferred"):
-                        exec_id = call_id or getattr(fcall, "id", None) or f"deferred-{fname}-{int(time.time()*1000)}"
-                        fr = types.FunctionResponse(
-                            id=exec_id,
-                            name=response_name,
-                            response={"status": "deferred_due_to_safety_ack"},
-                        )
-                        function_response_parts.append(fr)
-
-                    else:
-                        url = current_page_url()
-                        base_ack = {
-                            "function_name": fname,
-                            "acknowledged": True,
-                            "url": url,
-                            "page_url": url,
-                            "result": result if isinstance(result, dict) else {"result": str(result)}
-                        }
-                        new_screenshot = get_screenshot_bytes()
-                        exec_id = call_id or getattr(fcall, "id", None) or f"exec-{fname}-{int(time.time()*1000)}"
-
-                        fr = types.FunctionResponse(
-                            id=exec_id,
-                            name=response_name,
-                            response=base_ack,
-                            parts=[types.FunctionResponsePart(
-                                inline_data=types.FunctionResponseBlob(
-                                    mime_type="image/png",
-                                    data=new_screenshot
-                                )
-                            )],
-                        )
-                        function_response_parts.append(fr)
-
-                except Exception as e:
-                    fr = types.FunctionResponse(
-                        id=call_id or getattr(fcall, "id", None) or f"error-{fname}-{int(time.time()*1000)}",
-                        name=fname,
-                        response={"status": "error", "message": f"builder_exception: {str(e)}"},
-                    )
-                    function_response_parts.append(fr)
-
-            if len(function_response_parts) != len(action_results):
-                print("[WARN] FR count mismatch; synthesizing missing responses.")
-                while len(function_response_parts) < len(action_results):
-                    idx = len(function_response_parts)
-                    item = action_results[idx]
-                    if len(item) == 4:
-                        fname, _, fcall, call_id = item
-                    else:
-                        fname, _, fcall = item
-                        call_id = getattr(fcall, "id", None)
-                    response_name = fname
-                    function_response_parts.append(types.FunctionResponse(
-                        id=call_id or getattr(fcall, "id", None) or f"synth-{fname}-{int(time.time()*1000)}",
-                        name=response_name,
-                        response={"status": "synthesized_missing_response"},
-                    ))
+            # The model only needs the post-action screen once: attach it to the last executed call
+            # that can change what's on screen. Turns made only of non-visual tools skip the capture.
+            last_exec_idx = max(
+                (i for i, item in enumerate(action_results)
+                 if _fr_kind(item[1]) == "exec" and item[0] not in _NON_VISUAL_TOOLS),
+                default=-1,
+            )
+            # Page loads are awaited by Playwright, but give freshly navigated pages a moment to
+            # paint before the screenshot the model will reason about.
+            if any(item[0] in _SETTLE_AFTER_TOOLS for item in action_results):
+                time.sleep(NAV_SETTLE_SEC)
+            # Capture + encode in the background while the acks are assembled below.
+            shot_future = _executor.submit(get_screenshot_bytes) if last_exec_idx >= 0 else None
+            # No actions run while building responses, so one URL read serves every ack.
+            url = current_page_url()
+
+            function_response_parts = [
+                _build_function_response(item, url, shot_future if idx == last_exec_idx else None)
+                for idx, item in enumerate(action_results)
+            ]
+            names_emitted = [item[0] for item in action_results]
 
             print(f"[Debug] Emitted {len(names_emitted)} FunctionResponses for: {names_emitted}")
             chat_history.append(Content(role="user", parts=[Part(function_response=fr) for fr in function_response_parts]))
+            _prune_history_screenshots(chat_history)
+            _compact_history(chat_history)
 
         print("--- Agent session finished ---")
         if playwright_context.get("context"):
@@ -880,17 +1489,12 @@ I will now execute the following plan. I will perform all actions within the bro
                 playwright_context["context"].close()
             except Exception:
                 pass
-        if playwright_context.get("browser"):
-            try:
-                playwright_context["browser"].close()
-            except Exception:
-                pass
 
 if __name__ == "__main__":
     try:
         run_agent()
     except pyautogui.FailSafeException:
-        print("\n[ABORTED] Fail-safe triggered — mouse moved to top-left corner.")
-        if playwright_context.get("browser"):
-            playwright_context["browser"].close()
+        print("\n[ABORTED] Fail-safe triggered - mouse moved to top-left corner.")
+        if playwright_context.get("context"):
+            playwright_context["context"].close()
         exit(0)
@@ -21,11 +21,21 @@ import sys
 import time
 import os, re, random
 import io
-from typing import Any, Dict, List, Tuple, Optional
+import shutil
+import functools
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple, Optional
 from datetime import datetime
 import pyautogui
 from playwright.sync_api import sync_playwright, Page
 
+try:
+    import mss  # optional: ctypes screen grab, much cheaper than pyautogui/pyscreeze
+except ImportError:
+    mss = None
+
 from google import genai
 from google.genai import types
 from google.genai.types import Content, Part, FunctionCall
@@ -48,22 +58,40 @@ DEVICE_TYPE = "MacBook"
 # DEVICE_TYPE = "Windows 11 PC"
 
 pyautogui.FAILSAFE = True
-pyautogui.PAUSE = 1.0
+# A global PAUSE sleeps after every pyautogui primitive (each key of a hotkey, each click); the UI
+# only needs time to react once per turn, which _settle() gives before the screenshot.
+pyautogui.PAUSE = 0.05
+pyautogui.MINIMUM_DURATION = 0
+pyautogui.MINIMUM_SLEEP = 0
+
+# Post-action waits before the next screenshot: longer after navigation, short after plain input
+_SETTLE_AFTER_TOOLS = frozenset({"open_browser_and_navigate", "pw_navigate", "navigate", "pw_go_back", "tabs_open_new"})
+NAV_SETTLE_SEC = 0.5
+INPUT_SETTLE_SEC = 0.3
 
 client = genai.Client(api_key=API_KEY)
 
+# Background work that must not touch Playwright objects (sync API is bound to the main thread)
+_executor = ThreadPoolExecutor(max_workers=4)
+
 SCREEN_WIDTH, SCREEN_HEIGHT = pyautogui.size()
 cuse_grid = 1000
 
+# Frames sent to the model are JPEG (several times smaller than PNG); files under ./screenshots stay PNG.
+SCREENSHOT_MIME_TYPE = "image/jpeg"
+SCREENSHOT_JPEG_QUALITY = 70
+SCREENSHOT_MAX_DIM = 1024  # long edge of model frames; coordinates come back on cuse_grid either way
+
 # --- Paths ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SCREENSHOT_DIR = os.path.join(BASE_DIR, "screenshots")
 os.makedirs(SCREENSHOT_DIR, exist_ok=True)
+# Chromium profile reused across runs (cookies, SSO session, HTTP cache); --clean-profile wipes it
+PROFILE_DIR = os.path.join(BASE_DIR, ".pw_profile")
 
 # --- Playwright Global State ---
 playwright_context: Dict[str, Any] = {
     "playwright": None,
-    "browser": None,
     "context": None,
     "page": None,
 }
@@ -125,36 +153,109 @@ def _get_function_call_id(part) -> Optional[str]:
 def _timestamp():
     return datetime.now().strftime("%Y%m%d_%H%M%S")
 
+_UNSAFE_NAME_RE = re.compile(r'[^a-zA-Z0-9._-]+')
+
+@functools.lru_cache(maxsize=512)
 def _safe_name(s: str) -> str:
-    return re.sub(r'[^a-zA-Z0-9._-]+', '_', s.strip()) or "unnamed"
+    return _UNSAFE_NAME_RE.sub('_', s.strip()) or "unnamed"
+
+# Last frame sent to the model; lets an identical next frame skip the encode and the upload
+_shot_cache: Dict[str, Any] = {"hash": None, "bytes": None, "url": None, "unchanged": False}
+
+# mss handles are bound to the thread that opened them (X11 display, GDI DCs), so each thread
+# keeps its own grabber.
+_mss_local = threading.local()
+
+def _grab_desktop():
+    """Primary-monitor capture as a PIL RGB image: mss when available, pyautogui otherwise."""
+    from PIL import Image
+
+    if mss is not None:
+        try:
+            sct = getattr(_mss_local, "sct", None)
+            if sct is None:
+                sct = _mss_local.sct = mss.mss()
+            grab = sct.grab(sct.monitors[1])
+            # Decode BGRA straight into RGB; skips mss's pure-Python .rgb conversion.
+            return Image.frombytes("RGB", grab.size, grab.bgra, "raw", "BGRX")
+        except Exception as e:
+            print(f"[mss grab failed; using pyautogui] {e}")
+    return pyautogui.screenshot()
 
 def get_screenshot_bytes() -> bytes:
-    screenshot = pyautogui.screenshot()
+    from PIL import Image
+
+    screenshot = _grab_desktop()
+    # The model answers on the 0-1000 cuse_grid and denormalize() maps back to SCREEN_WIDTH/HEIGHT,
+    # so native (Retina) resolution buys nothing but upload bytes and vision tokens.
+    scale = SCREENSHOT_MAX_DIM / max(screenshot.size)
+    if scale < 1.0:
+        screenshot = screenshot.resize(
+            (int(screenshot.width * scale), int(screenshot.height * scale)), Image.BILINEAR
+        )
+    screenshot = screenshot.convert('RGB')
+    # Exact digest, not a perceptual hash: flipping one settings toggle moves only a few pixels,
+    # and a near-match threshold would report that as "unchanged".
+    digest = hashlib.blake2b(screenshot.tobytes(), digest_size=16).digest()
+    url = current_page_url()
+    unchanged = digest == _shot_cache["hash"] and url == _shot_cache["url"]
+    _shot_cache["unchanged"] = unchanged
+    if unchanged:
+        return _shot_cache["bytes"]
     img_byte_arr = io.BytesIO()
-    screenshot.save(img_byte_arr, format='PNG')
-    return img_byte_arr.getvalue()
+    screenshot.save(img_byte_arr, format='JPEG', quality=SCREENSHOT_JPEG_QUALITY, optimize=False)
+    data = img_byte_arr.getvalue()
+    _shot_cache.update(hash=digest, bytes=data, url=url)
+    return data
+
+# Every on-grid coordinate precomputed per screen axis (1001 ints each)
+_DENORM_TABLES: Dict[int, List[int]] = {
+    m: [i * m // cuse_grid for i in range(cuse_grid + 1)] for m in (SCREEN_WIDTH, SCREEN_HEIGHT)
+}
 
 def denormalize(value: int, max_value: int) -> int:
+    table = _DENORM_TABLES.get(max_value)
+    if table is not None and isinstance(value, int) and 0 <= value <= cuse_grid:
+        return table[value]
     return int((value * max_value) / cuse_grid)
 
 # --- Screenshot utilities (GENERALIZED) ---
 def ensure_dir(path: str):
     os.makedirs(os.path.dirname(path), exist_ok=True)
 
+def _report_save(path: str):
+    def _done(fut: Future):
+        err = fut.exception()
+        print(f"[save failed] {path}: {err}" if err else f"[saved] {path}")
+    return _done
+
+def _write_file(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+
+def _save_bytes_async(path: str, data: bytes) -> None:
+    _executor.submit(_write_file, path, data).add_done_callback(_report_save(path))
+
 def save_desktop_screenshot(label: str = "desktop") -> Dict[str, Any]:
-    """Captures a full desktop screenshot via pyautogui into ./screenshots."""
+    """Captures a full desktop screenshot via pyautogui into ./screenshots.
+
+    The grab happens now; the PNG encode and write run on _executor so the agent can move on.
+    """
     try:
         ts = _timestamp()
         fname = f"{_safe_name(label)}_{ts}.png"
         full_path = os.path.join(SCREENSHOT_DIR, fname)
-        pyautogui.screenshot(full_path)
-        print(f"[saved] {full_path}")
+        img = _grab_desktop()
+        _executor.submit(img.save, full_path).add_done_callback(_report_save(full_path))
         return {"status": "success", "path": full_path, "filename": fname}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-def page_full_screenshot(label: str = "page", subfolder: str = "") -> Dict[str, Any]:
-    """Captures Playwright page full_page screenshot into ./screenshots[/subfolder]."""
+def page_full_screenshot(label: str = "page", subfolder: str = "", full_page: bool = True) -> Dict[str, Any]:
+    """Captures a Playwright page screenshot into ./screenshots[/subfolder].
+
+    full_page=False grabs only the viewport, which skips Chromium's full-layout re-render.
+    """
     try:
         pg: Page = playwright_context.get("page")
         if not pg:
@@ -164,8 +265,13 @@ def page_full_screenshot(label: str = "page", subfolder: str = "") -> Dict[str,
         os.makedirs(folder, exist_ok=True)
         fname = f"{_safe_name(label)}_{ts}.png"
         out = os.path.join(folder, fname)
-        pg.screenshot(path=out, full_page=True)
-        print(f"[saved] {out}")
+        # Navigations return at DOMContentLoaded; give lazy images a short, capped chance to land.
+        try:
+            pg.wait_for_load_state("networkidle", timeout=5000)
+        except Exception:
+            pass
+        # Playwright hands back the encoded PNG; only the disk write moves off this thread.
+        _save_bytes_async(out, pg.screenshot(full_page=full_page, animations="disabled", caret="hide"))
         return {"status": "success", "path": out, "filename": fname}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -184,8 +290,7 @@ def page_element_screenshot(selector: str, label: str = "element", subfolder: st
         os.makedirs(folder, exist_ok=True)
         fname = f"{_safe_name(label)}_{ts}.png"
         out = os.path.join(folder, fname)
-        loc.first.screenshot(path=out)
-        print(f"[saved] {out}")
+        _save_bytes_async(out, loc.first.screenshot(animations="disabled", caret="hide"))
         return {"status": "success", "path": out, "filename": fname}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -199,7 +304,7 @@ def pw_click_button_by_text(text: str, timeout_ms: int = 5000) -> dict:
 
         # 1) Prefer modal/dialog scope if present
         try:
-            dialog = pg.get_by_role("dialog").filter(has_text=re.compile(r".*", re.S)).first
+            dialog = pg.get_by_role("dialog").first
             dialog.wait_for(state="visible", timeout=1500)
             btn = dialog.get_by_role("button", name=text, exact=True)
             if btn.count():
@@ -221,36 +326,39 @@ def pw_click_button_by_text(text: str, timeout_ms: int = 5000) -> dict:
         return {"status": "error", "message": str(e)}
 
 # --- Browser lifecycle / navigation ---
+def _launch_browser(p):
+    """Open the persistent-profile context; Chromium keeps session state in PROFILE_DIR itself."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return p.chromium.launch_persistent_context(
+        user_data_dir=PROFILE_DIR,
+        headless=False,
+        viewport={"width": 1280, "height": 720},
+        device_scale_factor=1.0,
+        accept_downloads=True,
+        # You can grant permissions generically if desired by instructions:
+        # permissions=["camera","microphone","notifications"],
+        args=[
+            "--disable-features=IsolateOrigins,site-per-process",
+            f"--window-position=0,0",
+            f"--window-size=1280,720",
+            # Keep media prompts visible unless your instructions say otherwise:
+            # "--use-fake-ui-for-media-stream",
+        ],
+        timeout=30_000,
+    )
+
 def open_browser_and_navigate(url: str) -> Dict[str, str]:
     try:
         p = playwright_context.get("playwright")
         if not p:
             return {"status": "error", "message": "Playwright not initialized."}
 
-        win_w, win_h = SCREEN_WIDTH, SCREEN_HEIGHT
-        browser = p.chromium.launch(
-            headless=False,
-            args=[
-                "--disable-features=IsolateOrigins,site-per-process",
-                f"--window-position=0,0",
-                f"--window-size=1280,720",
-                # Keep media prompts visible unless your instructions say otherwise:
-                # "--use-fake-ui-for-media-stream",
-            ],
-        )
-
-        context = browser.new_context(
-            viewport={"width": 1280, "height": 720},
-            device_scale_factor=1.0,
-            accept_downloads=True,
-            # You can grant permissions generically if desired by instructions:
-            # permissions=["camera","microphone","notifications"],
-        )
-        page = context.new_page()
+        # Reuse the already-open profile context if the model calls this more than once.
+        context = playwright_context.get("context") or _launch_browser(p)
+        page = context.pages[0] if context.pages else context.new_page()
         page.bring_to_front()
-        page.goto(url, wait_until="load", timeout=60_000)
+        page.goto(url, wait_until="domcontentloaded", timeout=30_000)
 
-        playwright_context["browser"] = browser
         playwright_context["page"] = page
         playwright_context["context"] = context
 
@@ -265,7 +373,7 @@ def pw_navigate(url: str) -> Dict[str, str]:
         if not pg:
             return {"status": "error", "message": "No active page"}
         pg.bring_to_front()
-        pg.goto(url, wait_until="load", timeout=60_000)
+        pg.goto(url, wait_until="domcontentloaded", timeout=30_000)
         return {"status": "success", "url": pg.url}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -277,7 +385,7 @@ def pw_go_back(steps: int = 1) -> Dict[str, str]:
             return {"status": "error", "message": "No active page"}
         pg.bring_to_front()
         for _ in range(max(1, steps)):
-            pg.go_back(wait_until="load", timeout=60_000)
+            pg.go_back(wait_until="domcontentloaded", timeout=30_000)
         return {"status": "success", "url": pg.url}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -288,7 +396,7 @@ def tabs_open_new(url: str) -> Dict[str, str]:
         if not ctx:
             return {"status": "error", "message": "No active context"}
         p = ctx.new_page()
-        p.goto(url, wait_until="load", timeout=60_000)
+        p.goto(url, wait_until="domcontentloaded", timeout=30_000)
         p.bring_to_front()
         playwright_context["page"] = p
         return {"status": "success", "url": p.url}
@@ -301,24 +409,87 @@ def tabs_switch_to(substr: str, timeout_ms: int = 10000) -> Dict[str, str]:
         ctx = playwright_context.get("context")
         if not ctx:
             return {"status": "error", "message": "No active context"}
-        deadline = time.time() + (timeout_ms/1000.0)
-        while time.time() < deadline:
+        needle = substr.lower()
+
+        def _find():
             for p in ctx.pages:
-                if substr.lower() in (p.url or "").lower():
-                    p.bring_to_front()
-                    playwright_context["page"] = p
-                    return {"status": "success", "url": p.url}
-            time.sleep(0.2)
-        return {"status": "error", "message": f"No tab containing '{substr}'"}
+                if needle in (p.url or "").lower():
+                    return p
+            return None
+
+        deadline = time.time() + (timeout_ms/1000.0)
+        match = _find()
+        while match is None:
+            remaining_ms = (deadline - time.time()) * 1000
+            if remaining_ms <= 0:
+                return {"status": "error", "message": f"No tab containing '{substr}'"}
+            try:
+                # Wake as soon as a tab opens. New tabs usually start at about:blank, so wait for
+                # the document before matching; the 1s slice also catches in-place navigations.
+                new_page = ctx.wait_for_event("page", timeout=min(remaining_ms, 1000))
+                new_page.wait_for_load_state("domcontentloaded", timeout=max(1, int((deadline - time.time()) * 1000)))
+            except Exception:
+                pass
+            match = _find()
+        match.bring_to_front()
+        playwright_context["page"] = match
+        return {"status": "success", "url": match.url}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 # --- Generic UI label clicks ---
-def ui_click_any_label(labels: List[str], timeout_ms: int = 5000) -> dict:
+def _any_label_locator(scope, labels: List[str]):
+    combined = None
     for lbl in labels:
-        r = ui_click_label(lbl, timeout_ms)
-        if r.get("status") == "success":
-            return r
+        loc = scope.get_by_role("button", name=lbl, exact=True).or_(scope.get_by_role("link", name=lbl, exact=True))
+        combined = loc if combined is None else combined.or_(loc)
+    return combined
+
+DIALOG_WAIT_MS = 1200  # bounded wait for a confirm modal that may still be animating in
+
+def _label_scopes(pg: "Page", timeout_ms: int):
+    """[(name, scope)] to search for a label: dialog first if one shows up within DIALOG_WAIT_MS."""
+    dialog = pg.get_by_role("dialog").first
+    try:
+        dialog.wait_for(state="visible", timeout=min(DIALOG_WAIT_MS, timeout_ms))
+        return [("dialog", dialog), ("page", pg)]
+    except Exception:
+        return [("page", pg)]
+
+def ui_click_any_label(labels: List[str], timeout_ms: int = 5000) -> dict:
+    """Click the first visible control matching any of `labels`, dialog before page.
+
+    One wait (bounded by timeout_ms) on a compound locator over every label replaces
+    len(labels) sequential ui_click_label probes. Once something is visible, candidates are
+    tried in priority order: scope, then label order, then button, link and plain text."""
+    pg: Page = playwright_context.get("page")
+    if not pg or not labels:
+        return {"status": "error", "message": f"No label matched from {labels}"}
+    try:
+        scopes = _label_scopes(pg, timeout_ms)
+        any_loc = None
+        for _, scope in scopes:
+            loc = _any_label_locator(scope, labels)
+            for lbl in labels:
+                loc = loc.or_(scope.locator(f"text={lbl}"))
+            any_loc = loc if any_loc is None else any_loc.or_(loc)
+        try:
+            any_loc.first.wait_for(state="visible", timeout=timeout_ms)
+        except Exception:
+            return {"status": "error", "message": f"No label matched from {labels}"}
+
+        for scope_name, scope in scopes:
+            for lbl in labels:
+                for locator in [
+                    scope.get_by_role("button", name=lbl, exact=True),
+                    scope.get_by_role("link", name=lbl, exact=True),
+                    scope.locator(f"text={lbl}")
+                ]:
+                    if locator.first.is_visible():
+                        locator.first.click(timeout=timeout_ms)
+                        return {"status": "success", "scope": scope_name, "clicked": lbl}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
     return {"status": "error", "message": f"No label matched from {labels}"}
 
 def ui_click_label(label: str, timeout_ms: int = 5000) -> dict:
@@ -328,31 +499,27 @@ def ui_click_label(label: str, timeout_ms: int = 5000) -> dict:
         if not pg:
             return {"status": "error", "message": "No active page"}
 
-        # 1) Try dialog-scope first
-        try:
-            dialog = pg.get_by_role("dialog").first
-            dialog.wait_for(state="visible", timeout=1200)
-            for locator in [
-                dialog.get_by_role("button", name=label, exact=True),
-                dialog.get_by_role("link", name=label, exact=True),
-                dialog.locator(f"text={label}")
-            ]:
+        # One bounded wait for a dialog (a confirm modal may still be animating in). A visible
+        # dialog's controls are already rendered, so it is probed directly; the page scope gets
+        # one wait (bounded by timeout_ms) on the union of its candidates. The count() probes
+        # themselves don't wait.
+        for scope_name, scope in _label_scopes(pg, timeout_ms):
+            candidates = [
+                scope.get_by_role("button", name=label, exact=True),
+                scope.get_by_role("link", name=label, exact=True),
+                scope.locator(f"text={label}")
+            ]
+            if scope_name == "page":
+                try:
+                    candidates[0].or_(candidates[1]).or_(candidates[2]).first.wait_for(
+                        state="visible", timeout=timeout_ms)
+                except Exception:
+                    continue
+            # First non-empty probe in priority order
+            for locator in candidates:
                 if locator.count():
                     locator.first.click(timeout=timeout_ms)
-                    return {"status": "success", "scope": "dialog", "clicked": label}
-        except Exception:
-            pass
-
-        # 2) Fallback to page scope
-        for locator in [
-            pg.get_by_role("button", name=label, exact=True),
-            pg.get_by_role("link", name=label, exact=True),
-            pg.locator(f"text={label}")
-        ]:
-            if locator.count():
-                locator.first.wait_for(state="visible", timeout=timeout_ms)
-                locator.first.click(timeout=timeout_ms)
-                return {"status": "success", "scope": "page", "clicked": label}
+                    return {"status": "success", "scope": scope_name, "clicked": label}
 
         return {"status": "error", "message": f"Label not found: {label}"}
     except Exception as e:
@@ -374,11 +541,41 @@ def provide_signup_password() -> Dict[str, str]:
     return {"status": "success", "password": pwd_web}
 
 # --- Action Execution Loop ---
+def _is_plain_text_part(part) -> bool:
+    return bool(getattr(part, "text", None)) and not getattr(part, "function_call", None) \
+        and not getattr(part, "thought_signature", None)
+
+def _collect_stream(stream):
+    """Accumulate a generate_content_stream into one response shaped like generate_content's."""
+    parts = []
+    last = None
+    for chunk in stream:
+        last = chunk
+        cands = getattr(chunk, "candidates", None) or []
+        content = getattr(cands[0], "content", None) if cands else None
+        for part in (getattr(content, "parts", None) or []):
+            # Text arrives in fragments; glue consecutive plain-text fragments back together.
+            if parts and _is_plain_text_part(part) and _is_plain_text_part(parts[-1]):
+                parts[-1] = Part(text=parts[-1].text + part.text)
+            else:
+                parts.append(part)
+    if last is None or not parts:
+        return last
+    last_cand = last.candidates[0] if last.candidates else None
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(
+            content=Content(role="model", parts=parts),
+            finish_reason=getattr(last_cand, "finish_reason", None),
+        )],
+        usage_metadata=getattr(last, "usage_metadata", None),
+    )
+
 def call_model_with_retries(client, model, contents, config, max_retries=4):
     delay = 1.0
     for attempt in range(1, max_retries + 1):
         try:
-            resp = client.models.generate_content(model=model, contents=contents, config=config)
+            stream = client.models.generate_content_stream(model=model, contents=contents, config=config)
+            resp = _collect_stream(stream)
             return True, resp
         except Exception as e:
             err = str(e)
@@ -388,6 +585,150 @@ def call_model_with_retries(client, model, contents, config, max_retries=4):
             time.sleep(delay + random.uniform(0, 0.5))
             delay *= 2
 
+def _log_usage(response) -> None:
+    """Print prompt vs implicitly-cached tokens so prefix-cache hits are visible per turn."""
+    um = getattr(response, "usage_metadata", None)
+    if not um:
+        return
+    prompt = getattr(um, "prompt_token_count", None) or 0
+    cached = getattr(um, "cached_content_token_count", None) or 0
+    print(f"[Usage] prompt_tokens={prompt} cached_tokens={cached}")
+
+# --- Tool handlers: each takes the call's args and returns the action_result dict ---
+_KEY_MAP = {"control": "ctrl", "command": "cmd", "windows": "win"}
+
+def _do_click_at(args: dict) -> dict:
+    x = denormalize(args["x"], SCREEN_WIDTH)
+    y = denormalize(args["y"], SCREEN_HEIGHT)
+    pyautogui.click(x, y)
+    return {"status": "success", "x": x, "y": y}
+
+_CLICK_PROBE_WAIT_S = 0.3  # how long to wait for the OS click to reach the page
+
+def _arm_click_probe() -> None:
+    """Record the client coordinates of the next mousedown in the page, so the field check can
+    tell whether our (asynchronously delivered) OS click has actually landed yet."""
+    pg = playwright_context.get("page")
+    if not pg:
+        return
+    try:
+        pg.evaluate("""() => {
+            if (window.__cuProbe) document.removeEventListener('mousedown', window.__cuProbe, true);
+            window.__cuClick = null;
+            window.__cuProbe = (e) => { window.__cuClick = [e.clientX, e.clientY]; };
+            document.addEventListener('mousedown', window.__cuProbe, {capture: true, once: true});
+        }""")
+    except Exception:
+        pass
+
+def _clicked_field_is_empty() -> bool:
+    """True only when our click reached the page, focus is on the element at the click point,
+    and that field is empty. Anything unconfirmed returns False, so the caller clears."""
+    pg = playwright_context.get("page")
+    if not pg:
+        return False
+    deadline = time.time() + _CLICK_PROBE_WAIT_S
+    try:
+        while True:
+            state = pg.evaluate("""() => {
+                const pt = window.__cuClick;
+                if (!pt) return null;
+                const el = document.activeElement;
+                const hit = document.elementFromPoint(pt[0], pt[1]);
+                if (!document.hasFocus() || !el || !hit || !(el === hit || el.contains(hit))) return false;
+                if ('value' in el) return el.value === '';
+                return el.isContentEditable ? el.textContent === '' : false;
+            }""")
+            if state is not None or time.time() >= deadline:
+                return state is True
+            time.sleep(0.02)
+    except Exception:
+        return False
+
+def _do_type_text_at(args: dict) -> dict:
+    x = denormalize(args["x"], SCREEN_WIDTH)
+    y = denormalize(args["y"], SCREEN_HEIGHT)
+    text = args["text"]
+    press_enter = args.get("press_enter", False)
+    clear = bool(args.get("clear_before_typing", True))
+    if clear:
+        _arm_click_probe()
+    pyautogui.click(x, y)
+    # Computer Use sends clear_before_typing (default true); skip the select-all + delete round
+    # when the model opts out or the clicked field is confirmed empty.
+    cleared = clear and not _clicked_field_is_empty()
+    if cleared:
+        if sys.platform == "darwin":
+            pyautogui.hotkey('command', 'a')
+        else:
+            pyautogui.hotkey('ctrl', 'a')
+        pyautogui.press('backspace')
+    pyautogui.write(text, interval=0.05)
+    if press_enter:
+        pyautogui.press('enter')
+    return {"status": "success", "typed_len": len(text), "press_enter": press_enter, "cleared": cleared}
+
+def _do_key_combination(args: dict) -> dict:
+    mapped_keys = [_KEY_MAP.get(k, k) for k in args["keys"].lower().split('+')]
+    pyautogui.hotkey(*mapped_keys)
+    return {"status": "success", "keys": mapped_keys}
+
+def _do_wait_5_seconds(args: dict) -> dict:
+    time.sleep(5)
+    return {"status": "success"}
+
+def _do_scroll_at(args: dict) -> dict:
+    x = denormalize(args.get("x", 500), SCREEN_WIDTH)
+    y = denormalize(args.get("y", 500), SCREEN_HEIGHT)
+    direction = (args.get("direction") or "down").lower()
+    magnitude = int(args.get("magnitude", 200))
+    pyautogui.scroll(-magnitude if direction == "down" else magnitude, x=x, y=y)
+    return {"status": "success", "scrolled": direction, "magnitude": magnitude, "x": x, "y": y}
+
+def _do_wheel(args: dict) -> dict:
+    dy = int(args.get("dy", args.get("magnitude", 200)))
+    direction = "down" if dy > 0 else "up"
+    x = denormalize(args.get("x", 500), SCREEN_WIDTH)
+    y = denormalize(args.get("y", 500), SCREEN_HEIGHT)
+    pyautogui.scroll(-abs(dy) if direction == "down" else abs(dy), x=x, y=y)
+    return {"status": "success", "scrolled": direction, "magnitude": abs(dy), "x": x, "y": y}
+
+DISPATCH: Dict[str, Callable[[dict], dict]] = {
+    # Built-in Computer Use actions
+    "click_at": _do_click_at,
+    "type_text_at": _do_type_text_at,
+    "key_combination": _do_key_combination,
+    "wait_5_seconds": _do_wait_5_seconds,
+    "scroll_at": _do_scroll_at,
+    "wheel": _do_wheel,
+    "page_scroll": _do_wheel,
+    # Custom Tools / Navigation
+    "open_browser_and_navigate": lambda args: open_browser_and_navigate(args["url"]),
+    "save_desktop_screenshot": lambda args: save_desktop_screenshot(args.get("label", "desktop")),
+    "page_full_screenshot": lambda args: page_full_screenshot(
+        label=args.get("label", "page"), subfolder=args.get("subfolder", ""),
+        full_page=bool(args.get("full_page", True))),
+    "page_element_screenshot": lambda args: page_element_screenshot(
+        selector=args["selector"], label=args.get("label", "element"), subfolder=args.get("subfolder", "")),
+    "provide_signup_email": lambda args: provide_signup_email(),
+    "provide_signup_password": lambda args: provide_signup_password(),
+    "pw_navigate": lambda args: pw_navigate(args["url"]),
+    "navigate": lambda args: pw_navigate(args["url"]),
+    "pw_go_back": lambda args: pw_go_back(int(args.get("steps", 1))),
+    "click_button_by_text": lambda args: pw_click_button_by_text(args["text"], int(args.get("timeout_ms", 5000))),
+    "ui_click_label": lambda args: ui_click_label(args["label"], int(args.get("timeout_ms", 5000))),
+    "ui_click_any_label": lambda args: ui_click_any_label(args["labels"], int(args.get("timeout_ms", 5000))),
+    "tabs_open_new": lambda args: tabs_open_new(args["url"]),
+    "tabs_switch_to": lambda args: tabs_switch_to(args["substr"], int(args.get("timeout_ms", 10000))),
+}
+
+def _settle(fnames: List[str]) -> None:
+    """Single wait after a turn's actions so the next screenshot shows their effect."""
+    if any(n in _SETTLE_AFTER_TOOLS for n in fnames):
+        time.sleep(NAV_SETTLE_SEC)
+    elif fnames:
+        time.sleep(INPUT_SETTLE_SEC)
+
 def execute_function_calls(candidate) -> List[Tuple[str, Dict, FunctionCall]]:
     results = []
     wrapped_calls = []
@@ -437,7 +778,10 @@ def execute_function_calls(candidate) -> List[Tuple[str, Dict, FunctionCall]]:
     if results:
         return results
 
-    # Execute normal calls
+    # Execute normal calls.
+    # Calls run strictly in order: pyautogui shares one mouse/keyboard, the sync Playwright objects
+    # may only be used from this thread, and a capture must see the screen the preceding action left.
+    # Only the slow, order-free tail of a capture (encode + disk write) is pushed to _executor.
     for wc in wrapped_calls:
         fc = wc["fc"]
         fname = fc.name
@@ -445,108 +789,9 @@ def execute_function_calls(candidate) -> List[Tuple[str, Dict, FunctionCall]]:
         action_result = {}
         print(f"  Executing > {fname}({args})")
         try:
-            if fname == "click_at":
-                x = denormalize(args["x"], SCREEN_WIDTH)
-                y = denormalize(args["y"], SCREEN_HEIGHT)
-                pyautogui.moveTo(x, y, duration=0.3)
-                pyautogui.click()
-                action_result = {"status": "success", "x": x, "y": y}
-
-            elif fname == "type_text_at":
-                x = denormalize(args["x"], SCREEN_WIDTH)
-                y = denormalize(args["y"], SCREEN_HEIGHT)
-                text = args["text"]
-                press_enter = args.get("press_enter", False)
-                pyautogui.click(x, y)
-                if sys.platform == "darwin":
-                    pyautogui.hotkey('command', 'a')
-                else:
-                    pyautogui.hotkey('ctrl', 'a')
-                pyautogui.press('backspace')
-                pyautogui.write(text, interval=0.05)
-                if press_enter:
-                    pyautogui.press('enter')
-                action_result = {"status": "success", "typed_len": len(text), "press_enter": press_enter}
-
-            elif fname == "key_combination":
-                keys = args["keys"].lower().split('+')
-                key_map = {"control": "ctrl", "command": "cmd", "windows": "win"}
-                mapped_keys = [key_map.get(k, k) for k in keys]
-                pyautogui.hotkey(*mapped_keys)
-                action_result = {"status": "success", "keys": mapped_keys}
-
-            elif fname == "wait_5_seconds":
-                time.sleep(5)
-                action_result = {"status": "success"}
-
-            elif fname == "scroll_at":
-                x = denormalize(args.get("x", 500), SCREEN_WIDTH)
-                y = denormalize(args.get("y", 500), SCREEN_HEIGHT)
-                direction = (args.get("direction") or "down").lower()
-                magnitude = int(args.get("magnitude", 200))
-                pyautogui.moveTo(x, y, duration=0.2)
-                pyautogui.scroll(-magnitude if direction == "down" else magnitude)
-                action_result = {"status": "success", "scrolled": direction, "magnitude": magnitude, "x": x, "y": y}
-
-            elif fname in ("wheel", "page_scroll"):
-                dy = int(args.get("dy", args.get("magnitude", 200)))
-                direction = "down" if dy > 0 else "up"
-                x = denormalize(args.get("x", 500), SCREEN_WIDTH)
-                y = denormalize(args.get("y", 500), SCREEN_HEIGHT)
-                pyautogui.moveTo(x, y, duration=0.2)
-                pyautogui.scroll(-abs(dy) if direction == "down" else abs(dy))
-                action_result = {"status": "success", "scrolled": direction, "magnitude": abs(dy), "x": x, "y": y}
-
-            # --- Custom Tools / Navigation ---
-            elif fname == "open_browser_and_navigate":
-                action_result = open_browser_and_navigate(args["url"])
-
-            elif fname == "save_desktop_screenshot":
-                action_result = save_desktop_screenshot(args.get("label","desktop"))
-
-            elif fname == "page_full_screenshot":
-                action_result = page_full_screenshot(
-                    label=args.get("label","page"),
-                    subfolder=args.get("subfolder","")
-                )
-
-            elif fname == "page_element_screenshot":
-                action_result = page_element_screenshot(
-                    selector=args["selector"],
-                    label=args.get("label","element"),
-                    subfolder=args.get("subfolder","")
-                )
-
-            elif fname == "provide_signup_email":
-                action_result = provide_signup_email()
-
-            elif fname in ("pw_navigate", "navigate"):
-                action_result = pw_navigate(args["url"])
-
-            elif fname == "pw_go_back":
-                steps = int(args.get("steps", 1))
-                action_result = pw_go_back(steps)
-
-            elif fname == "provide_signup_password":
-                action_result = provide_signup_password()
-
-            elif fname == "click_button_by_text":
-                txt = args["text"]
-                to = int(args.get("timeout_ms", 5000))
-                action_result = pw_click_button_by_text(txt, to)
-
-            elif fname == "ui_click_label":
-                action_result = ui_click_label(args["label"], int(args.get("timeout_ms", 5000)))
-
-            elif fname == "ui_click_any_label":
-                action_result = ui_click_any_label(args["labels"], int(args.get("timeout_ms", 5000)))
-
-            elif fname == "tabs_open_new":
-                action_result = tabs_open_new(args["url"])
-
-            elif fname == "tabs_switch_to":
-                action_result = tabs_switch_to(args["substr"], int(args.get("timeout_ms", 10000)))
-
+            handler = DISPATCH.get(fname)
+            if handler:
+                action_result = handler(args)
             else:
                 print(f"Warning: Skipping unimplemented function {fname}")
                 action_result = {"error": f"Function {fname} not implemented locally."}
@@ -559,6 +804,33 @@ def execute_function_calls(candidate) -> List[Tuple[str, Dict, FunctionCall]]:
 
     return results
 
+# --- Chat history compaction ---
+KEEP_SCREENSHOTS = 2  # most recent screenshots kept inline; older ones become text placeholders
+
+def _prune_history_screenshots(history: List[Content], keep: int = KEEP_SCREENSHOTS) -> None:
+    """Strip all but the newest `keep` screenshots from history, in place.
+
+    Every turn re-sends the whole history, so without this the upload and the billed image tokens
+    grow with the square of the turn count. Responses already marked screen_unchanged_from_prev_turn
+    carry no image and don't count toward `keep`, so the frame they refer to stays inline.
+    """
+    seen = 0
+    for turn in range(len(history) - 1, -1, -1):
+        parts = history[turn].parts or []
+        for j in range(len(parts) - 1, -1, -1):
+            part = parts[j]
+            if getattr(part, "inline_data", None):
+                seen += 1
+                if seen > keep:
+                    parts[j] = Part(text=f"[screenshot omitted, turn {turn}]")
+                continue
+            fr = getattr(part, "function_response", None)
+            if fr and any(getattr(fp, "inline_data", None) for fp in (fr.parts or [])):
+                seen += 1
+                if seen > keep:
+                    fr.parts = None
+                    fr.response = {**(fr.response or {}), "screenshot": f"omitted (turn {turn})"}
+
 # --- Planning (unchanged) ---
 def generate_plan(client, user_prompt: str, screenshot_bytes: bytes, config) -> str:
     planning_prompt = f"""
@@ -590,7 +862,7 @@ Be specific about what buttons to click, what text to type, and what to look for
                 role="user",
                 parts=[
                     Part(text=planning_prompt),
-                    Part.from_bytes(data=screenshot_bytes, mime_type='image/png')
+                    Part.from_bytes(data=screenshot_bytes, mime_type=SCREENSHOT_MIME_TYPE)
                 ]
             )],
             config=planning_config
@@ -662,8 +934,10 @@ def run_agent():
             ),
             types.FunctionDeclaration(
                 name="page_full_screenshot",
-                description="Capture a full-page screenshot of the current Playwright page into ./screenshots",
-                parameters={"type":"object","properties":{"label":{"type":"string"},"subfolder":{"type":"string"}}}
+                description="Capture a full-page screenshot of the current Playwright page into ./screenshots. "
+                            "Pass full_page=false for a faster viewport-only capture when everything of interest is on screen.",
+                parameters={"type":"object","properties":{"label":{"type":"string"},"subfolder":{"type":"string"},
+                                                         "full_page":{"type":"boolean","default":True}}}
             ),
             types.FunctionDeclaration(
                 name="page_element_screenshot",
@@ -684,6 +958,11 @@ def run_agent():
         ]
 
         # 2) System instructions
+        # Built once and never mutated: the tools + system_instruction prefix must stay byte-identical
+        # across turns for Gemini's implicit context cache to hit. chat_history is NOT append-only:
+        # _prune_history_screenshots rewrites the response that just fell out of the KEEP_SCREENSHOTS
+        # window in place, so each turn's cacheable prefix ends at that rewritten turn. What stays
+        # cacheable is this config plus the history before it, which was already pruned last turn.
         config = types.GenerateContentConfig(
             tools=[types.Tool(computer_use=types.ComputerUse()),
                    types.Tool(function_declarations=custom_tools)],
@@ -737,7 +1016,13 @@ Targets (guidance)
         print(f"\nGoal: {user_prompt}\n")
 
         initial_screenshot = get_screenshot_bytes()
-        plan = generate_plan(client, user_prompt, initial_screenshot, config)
+        # Plan on a worker thread while Chromium starts here (sync Playwright must stay on this thread).
+        plan_future = _executor.submit(generate_plan, client, user_prompt, initial_screenshot, config)
+        try:
+            playwright_context["context"] = _launch_browser(p)
+        except Exception as e:
+            print(f"[Browser prelaunch failed; will launch on demand] {e}")
+        plan = plan_future.result()
 
         planning_context = f"""
 I will now execute the following plan. I will perform all actions within the browser window.
@@ -748,7 +1033,7 @@ I will now execute the following plan. I will perform all actions within the bro
             Content(role="user", parts=[
                 Part(text=user_prompt),
                 Part(text=planning_context),
-                Part.from_bytes(data=initial_screenshot, mime_type='image/png')
+                Part.from_bytes(data=initial_screenshot, mime_type=SCREENSHOT_MIME_TYPE)
             ])
         ]
 
@@ -756,7 +1041,6 @@ I will now execute the following plan. I will perform all actions within the bro
         MAX_TURNS = 40
         for turn in range(1, MAX_TURNS + 1):
             print(f"--- Turn {turn} ---")
-            time.sleep(2)
             print("Analyzing screen...")
 
             ok, response = call_model_with_retries(client, MODEL_ID, chat_history, config)
@@ -764,6 +1048,7 @@ I will now execute the following plan. I will perform all actions within the bro
                 print(f"API Error (after retries): {response}")
                 break
 
+            _log_usage(response)
             cands = getattr(response, "candidates", None) or []
             if not cands:
                 print("No candidates returned; retrying next turn.")
@@ -794,6 +1079,8 @@ I will now execute the following plan. I will perform all actions within the bro
                 ))
                 continue
 
+            _settle([item[0] for item in action_results if not (isinstance(item[1], dict) and item[1].get("ack_only"))])
+
             # Build FunctionResponses
             function_response_parts = []
             names_emitted = []
@@ -841,16 +1128,22 @@ I will now execute the following plan. I will perform all actions within the bro
                         new_screenshot = get_screenshot_bytes()
                         exec_id = call_id or getattr(fcall, "id", None) or f"exec-{fname}-{int(time.time()*1000)}"
 
+                        if _shot_cache["unchanged"]:
+                            # Same pixels and URL as the last frame the model saw: say so instead of re-uploading
+                            base_ack["screen_unchanged_from_prev_turn"] = True
+                            shot_parts = None
+                        else:
+                            shot_parts = [types.FunctionResponsePart(
+                                inline_data=types.FunctionResponseBlob(
+                                    mime_type=SCREENSHOT_MIME_TYPE,
+                                    data=new_screenshot
+                                )
+                            )]
                         fr = types.FunctionResponse(
                             id=exec_id,
                             name=response_name,
                             response=base_ack,
-                            parts=[types.FunctionResponsePart(
-                                inline_data=types.FunctionResponseBlob(
-                                    mime_type="image/png",
-                                    data=new_screenshot
-                                )
-                            )],
+                            parts=shot_parts,
                         )
                         function_response_parts.append(fr)
 
@@ -881,6 +1174,7 @@ I will now execute the following plan. I will perform all actions within the bro
 
             print(f"[Debug] Emitted {len(names_emitted)} FunctionResponses for: {names_emitted}")
             chat_history.append(Content(role="user", parts=[Part(function_response=fr) for fr in function_response_parts]))
+            _prune_history_screenshots(chat_history)
 
         print("--- Agent session finished ---")
         if playwright_context.get("context"):
@@ -888,17 +1182,15 @@ I will now execute the following plan. I will perform all actions within the bro
                 playwright_context["context"].close()
             except Exception:
                 pass
-        if playwright_context.get("browser"):
-            try:
-                playwright_context["browser"].close()
-            except Exception:
-                pass
 
 if __name__ == "__main__":
+    if "--clean-profile" in sys.argv[1:]:
+        shutil.rmtree(PROFILE_DIR, ignore_errors=True)
+        print(f"[profile] Removed {PROFILE_DIR}; starting from a fresh browser profile.")
     try:
         run_agent()
     except pyautogui.FailSafeException:
         print("\n[ABORTED] Fail-safe triggered — mouse moved to top-left corner.")
-        if playwright_context.get("browser"):
-            playwright_context["browser"].close()
+        if playwright_context.get("context"):
+            playwright_context["context"].close()
         exit(0)
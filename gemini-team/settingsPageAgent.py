@@ -9,7 +9,34 @@ import json
 import time
 
 
-def is_valid_link(href, text, role):
+# Shared by the single-link and batch classifiers
+LINK_CRITERIA = (
+    "Platforms often nest their setting toggles within nested links. The goal of this program is to find all " 
+    f"the user configurable setting toggles by crawling through the different links on LinkedIn's settings page. "
+    "Please determine if clicking this link will lead to a page that contains privacy/data/security SETTINGS TOGGLES or CONTROLS that users can enable/disable.\n\n"
+    "Links that lead to settings toggles include:\n"
+    "- /settings or /account\n"
+    "- /preferences or /config\n"
+    "- /admin or /profile\n"
+    "- /setup or /options\n"
+    "- Always verify that the main domain name is spelled correctly\n"
+    "Links that DO NOT lead to settings toggles include:\n"
+    "- Information/help pages (even if about privacy)\n"
+    "- Policy pages\n"
+    "- FAQ pages\n"
+    "- Blog posts or articles\n"
+    "- Privacy/settings pages in languages other than English\n"
+)
+
+# Model used for link classification during a crawl (batch and single-link
+# fallback alike). Yes/no link triage doesn't need pro, and flash keeps the
+# per-page batch fast. The model is part of the decision-cache key, so answers
+# from different models are never mixed.
+CLASSIFY_MODEL = "gemini-2.5-flash"
+BATCH_SIZE = 100  # max links per classify_links_batch request
+
+
+def is_valid_link(href, text, role, model="gemini-2.5-pro"):
     """
     Uses Google Gemini to determine if a link leads to settings toggles.
     
@@ -17,10 +44,12 @@ def is_valid_link(href, text, role):
         href: The URL of the link (absolute)
         text: The visible text of the link
         role: The role of the link
+        model: The Gemini model to ask
     
     Returns:
         dict: {"has_settings_toggles": "yes" or "no"}
-        Returns {"has_settings_toggles": "no"} on error
+        Returns None on error (API failure or unparseable response) so that
+        callers can tell a failed lookup apart from a real "no"
     """
     API_KEY = os.environ.get("GEMINI_API_KEY")
     if not API_KEY:
@@ -33,21 +62,7 @@ def is_valid_link(href, text, role):
 
     prompt = (
         f"Analyze this link from a privacy/settings page:\n\n{context}\n\n"
-        "Platforms often nest their setting toggles within nested links. The goal of this program is to find all " 
-        f"the user configurable setting toggles by crawling through the different links on LinkedIn's settings page. "
-        "Please determine if clicking this link will lead to a page that contains privacy/data/security SETTINGS TOGGLES or CONTROLS that users can enable/disable.\n\n"
-        "Links that lead to settings toggles include:\n"
-        "- /settings or /account\n"
-        "- /preferences or /config\n"
-        "- /admin or /profile\n"
-        "- /setup or /options\n"
-        "- Always verify that the main domain name is spelled correctly\n"
-        "Links that DO NOT lead to settings toggles include:\n"
-        "- Information/help pages (even if about privacy)\n"
-        "- Policy pages\n"
-        "- FAQ pages\n"
-        "- Blog posts or articles\n"
-        "- Privacy/settings pages in languages other than English\n"
+        + LINK_CRITERIA +
         "Return ONLY valid JSON in this exact format:\n"
         '{"has_settings_toggles": "yes"}\n'
         'or\n'
@@ -63,7 +78,7 @@ def is_valid_link(href, text, role):
     ###
     try:
         resp = client.models.generate_content(
-            model = "gemini-2.5-pro",
+            model = model,
             contents = [Content(role="user", parts=[Part(text=prompt)])],
             config = config
         )
@@ -86,7 +101,7 @@ def is_valid_link(href, text, role):
                         text = cand_text
         except Exception as e:
             print(f"Error extracting response text: {e}")
-            return {"has_settings_toggles": "no"}
+            return None
         
         # Parse JSON from response
         # Clean up the text (remove markdown code blocks if present)
@@ -103,11 +118,13 @@ def is_valid_link(href, text, role):
         try:
             result = json.loads(text)
 
-            if isinstance(result, dict) and "has_settings_toggles" in result:
-                return result
+            answer = str(result.get("has_settings_toggles", "")).lower() if isinstance(result, dict) else ""
+            if answer in ("yes", "no"):
+                return {"has_settings_toggles": answer}
             else:
-                # If JSON is valid but wrong format, default to no
-                return {"has_settings_toggles": "no"}
+                # JSON is valid but wrong format
+                print(f"Unexpected Gemini response format: {text}")
+                return None
         except json.JSONDecodeError:
             # If JSON parsing fails, try to extract yes/no from text
             text_lower = text.lower()
@@ -116,17 +133,204 @@ def is_valid_link(href, text, role):
             elif '"has_settings_toggles": "no"' in text_lower or '"has_settings_toggles":"no"' in text_lower:
                 return {"has_settings_toggles": "no"}
             else:
-                # Default to no if we can't parse
                 print(f"Could not parse Gemini response: {text}")
-                return {"has_settings_toggles": "no"}
+                return None
                 
     except Exception as e:
         print(f"Error calling Gemini API: {e}")
-        return {"has_settings_toggles": "no"}
+        return None
     
     ###
 
 
+def classify_links_batch(links, model=CLASSIFY_MODEL):
+    """
+    Classifies many links with a single Gemini request.
+
+    Args:
+        links: list of dicts with "href", "text" and "role" keys
+        model: The Gemini model to ask
+
+    Returns:
+        list: one {"has_settings_toggles": "yes" or "no"} per input link, in
+        the same order, with None for any link the model skipped.
+        Returns None if the whole request failed (API error, bad JSON).
+    """
+    results = [None for _ in links]
+    if not links:
+        return results
+
+    API_KEY = os.environ.get("GEMINI_API_KEY")
+    if not API_KEY:
+        print("Error: GEMINI_API_KEY not set.")
+        raise ValueError("Missing Gemini API key.")
+
+    client = genai.Client(api_key=API_KEY)
+
+    enumerated = [
+        {"i": i, "href": link["href"], "text": link["text"], "role": link["role"]}
+        for i, link in enumerate(links)
+    ]
+
+    prompt = (
+        "Analyze each link in this JSON array from a privacy/settings page:\n\n"
+        f"{json.dumps(enumerated, ensure_ascii=False)}\n\n"
+        + LINK_CRITERIA +
+        "Return ONLY a valid JSON array with one object per link, in this exact format:\n"
+        '[{"i": 0, "has_settings_toggles": "yes"}, {"i": 1, "has_settings_toggles": "no"}]\n\n'
+        "Do not include any other text, explanations, or markdown formatting. The page should strictly be related to LinkedIn."
+    )
+
+    config = types.GenerateContentConfig(
+        temperature = 0.2,
+        response_mime_type = "application/json",
+    )
+
+    try:
+        resp = client.models.generate_content(
+            model = model,
+            contents = [Content(role="user", parts=[Part(text=prompt)])],
+            config = config
+        )
+
+        text = (getattr(resp, "text", None) or "").strip()
+        if text.startswith("```json"):
+            text = text[7:]
+        elif text.startswith("```"):
+            text = text[3:]
+        if text.endswith("```"):
+            text = text[:-3]
+        text = text.strip()
+
+        decisions = json.loads(text)
+        if not isinstance(decisions, list):
+            print(f"Could not parse Gemini batch response: {text}")
+            return None
+
+        for d in decisions:
+            if not isinstance(d, dict):
+                continue
+            i = d.get("i")
+            answer = str(d.get("has_settings_toggles", "no")).lower()
+            if isinstance(i, int) and 0 <= i < len(links) and answer in ("yes", "no"):
+                results[i] = {"has_settings_toggles": answer}
+
+    except Exception as e:
+        print(f"Error calling Gemini API (batch of {len(links)}): {e}")
+        return None
+
+    return results
+
+
+# Memoized link decisions keyed by (model, normalized_href, text.lower(), role).
+# Shared nav links recur on almost every settings page, so most lookups are hits.
+_decision_cache = {}
+_decision_cache_path = None
+_decision_lookups = 0
+DECISION_FLUSH_EVERY = 50  # persist the cache every N lookups
+
+
+def load_decision_cache(path):
+    """Load previously saved link decisions from `path` (if it exists)."""
+    global _decision_cache_path
+    _decision_cache_path = path
+    _decision_cache.clear()
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        for entry in entries:
+            result = entry.get("result")
+            # Only keep real answers from a known model; skip anything malformed
+            if not entry.get("model"):
+                continue
+            if not isinstance(result, dict) or result.get("has_settings_toggles") not in ("yes", "no"):
+                continue
+            key = (entry["model"], entry["href"], entry["text"], entry["role"])
+            _decision_cache[key] = result
+        print(f"[INFO] Loaded {len(_decision_cache)} cached link decisions from {path}")
+    except Exception as e:
+        print(f"[WARN] Could not load decision cache {path}: {e}")
+        _decision_cache.clear()
+
+
+def save_decision_cache():
+    """Write the decision cache to disk as a JSON list (tuple keys aren't valid JSON keys)."""
+    if not _decision_cache_path:
+        return
+    entries = [
+        {"model": model, "href": href, "text": text, "role": role, "result": result}
+        for (model, href, text, role), result in _decision_cache.items()
+    ]
+    try:
+        os.makedirs(os.path.dirname(_decision_cache_path) or ".", exist_ok=True)
+        with open(_decision_cache_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=2)
+    except Exception as e:
+        print(f"[WARN] Could not save decision cache {_decision_cache_path}: {e}")
+
+
+def cached_is_valid_link(href, text, role):
+    """
+    is_valid_link with memoization. Only cache misses hit the Gemini API
+    (and pay the 1s quota sleep); hits return immediately.
+
+    Returns None when the lookup failed. Failures are never cached, so the
+    link is asked about again the next time it comes up (or next crawl).
+    """
+    global _decision_lookups
+    key = (CLASSIFY_MODEL, href, (text or "").lower(), role)
+
+    result = _decision_cache.get(key)
+    if result is None:
+        result = is_valid_link(href=href, text=text, role=role, model=CLASSIFY_MODEL)
+        if result is not None:
+            _decision_cache[key] = result
+        time.sleep(1)  # don't want to hit quota for gemini calls
+
+    _decision_lookups += 1
+    if _decision_lookups % DECISION_FLUSH_EVERY == 0:
+        save_decision_cache()
+
+    return result
+
+
+def cached_classify_links(links):
+    """
+    Fills the decision cache for a page's links. Cache misses are sent in
+    batches of BATCH_SIZE through classify_links_batch, with one quota sleep
+    per batch instead of one per link.
+
+    Failed batches and links the model skipped are left uncached; the crawl
+    loop then falls back to a single-link cached_is_valid_link call for them.
+    """
+    global _decision_lookups
+    misses = {}
+    for link in links:
+        key = (CLASSIFY_MODEL, link["href"], (link["text"] or "").lower(), link["role"])
+        if key not in _decision_cache and key not in misses:
+            misses[key] = link
+
+    stored = 0
+    pending = list(misses.items())
+    for start in range(0, len(pending), BATCH_SIZE):
+        chunk = pending[start:start + BATCH_SIZE]
+        decisions = classify_links_batch([link for _, link in chunk], model=CLASSIFY_MODEL)
+        time.sleep(1)  # don't want to hit quota for gemini calls
+        if decisions is None:
+            print(f"[WARN] Batch of {len(chunk)} links failed; falling back to per-link checks")
+            continue
+        for (key, _), result in zip(chunk, decisions):
+            if result is not None:
+                _decision_cache[key] = result
+                stored += 1
+
+    _decision_lookups += len(links)
+    if stored:
+        save_decision_cache()
+
+
 def sanitize_filename(text):
     """Remove invalid filename characters"""
     if not text:
@@ -144,6 +348,9 @@ def crawl_settings(url):
         STATE_DIR = os.path.join(BASE_DIR, "profiles", "storage")
         host = urlparse(url).hostname # changed
         state_path = os.path.join(STATE_DIR, f"{host}.json")
+
+        # Reuse link decisions from earlier crawls of this host
+        load_decision_cache(f"picasso/{host}_decisions.json")
         
         browser = p.chromium.launch(headless=False)
         # page = browser.new_page() i wrote this
@@ -218,6 +425,11 @@ def crawl_settings(url):
                 print(f"Initial link array is empty: {e}")
                 raise
 
+        # Classify the whole page in one Gemini call; the loop below reads cache hits
+        cached_classify_links([
+            {"href": h, "text": t, "role": r} for h, t, r, _ in link_queue
+        ])
+
         # Stopping condition: max iterations
         iteration_count = 0
         max_iterations = 5000
@@ -230,11 +442,15 @@ def crawl_settings(url):
 
             href, text, role, depth = link_queue.pop(0)  # Now includes depth
 
-            result = is_valid_link(href=href, text=text, role=role)
-            time.sleep(1)  # don't want to hit quota for gemini calls
+            result = cached_is_valid_link(href=href, text=text, role=role)
 
             print(f"Visiting (depth {depth}): {text} -> {href}, Result: {result}")
 
+            if result is None:
+                # Lookup failed; don't mark visited so the link can be retried
+                # if another page links to it again
+                continue
+
             if (href in visited_links) or (result["has_settings_toggles"] == "no"):
                 visited_links.add(href)
                 continue
@@ -261,6 +477,8 @@ def crawl_settings(url):
                 if layer_key not in layer_dict:
                     layer_dict[layer_key] = []
 
+                queued_before = len(link_queue)
+
                 for a_tag in a_tags:
                     try:
                         new_href = a_tag.get_attribute("href")
@@ -283,6 +501,12 @@ def crawl_settings(url):
                     except Exception as e:
                         continue
 
+                # One batch request for every new link found on this page
+                cached_classify_links([
+                    {"href": h, "text": t, "role": r}
+                    for h, t, r, _ in link_queue[queued_before:]
+                ])
+
             except Exception as e:
                 print(f"Error visiting {href}: {e}")
                 continue
@@ -302,6 +526,8 @@ def crawl_settings(url):
         
         with open(output_path, "w", encoding="utf-8") as f:
             json.dump(output_data, f, indent=2)
+
+        save_decision_cache()
         
         print(f"\n{'='*60}")
         print(f"✓ Crawl results saved to {output_path}")